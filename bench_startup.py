@@ -0,0 +1,130 @@
+"""
+CLI startup benchmark + regression guard.
+
+    python bench_startup.py                 # report, exit 1 on regression
+    python bench_startup.py --budget-ms 30 --runs 10
+
+Each light subcommand is run for real (connect, init_db and its migration
+checks, then the command itself) against a scratch database in a temp dir,
+best of N runs minus bare interpreter startup. One more run per command under
+`-X importtime` checks that none of the heavy dependencies get imported.
+"""
+import argparse
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+
+HEAVY_MODULES = ("requests", "mwparserfromhell", "pandas", "numpy", "streamlit", "plotly")
+
+# name -> (cli.py arguments, budget in ms or None for --budget-ms); {tmp} is
+# the scratch directory. serve blocks, so it gets --help plus an import of the
+# module its run() loads; http.server alone costs it ~20ms.
+LIGHT_COMMANDS = {
+    "export": (["export", "--out", "{tmp}/npc_core.csv"], None),
+    "stats": (["stats"], None),
+    "compress": (["compress", "--no-vacuum"], None),
+    "serve": (["serve", "--help"], 75.0),
+    "db": (["db", "optimize"], None),
+    "derive": (["derive"], None),
+}
+PRELOAD = {"serve": "service"}
+
+def cli_argv(tmp, name, args):
+    """
+    python -c program that points config at the scratch dir, then runs cli.main().
+    """
+    args = [a.format(tmp=tmp) for a in args]
+    return ["-c", "import config\n"
+                  f"config.DB_PATH = {tmp + '/p99.sqlite'!r}\n"
+                  f"config.METRICS_PATH = {tmp + '/metrics.json'!r}\n"
+                  f"config.PROFILE_DIR = {tmp + '/profiles'!r}\n"
+                  f"import sys; sys.argv = {['cli.py'] + args!r}\n"
+                  + (f"import {PRELOAD[name]}\n" if name in PRELOAD else "")
+                  + "import cli\n"
+                  "try:\n    cli.main()\nexcept SystemExit:\n    pass"]
+
+def run_once(argv, importtime=False):
+    """
+    Returns (elapsed_ms, stderr). -X importtime itself slows startup, so timed
+    runs go without it and a separate run collects the import list.
+    """
+    flags = ["-X", "importtime"] if importtime else []
+    t = time.perf_counter()
+    r = subprocess.run([sys.executable, *flags, *argv], cwd=HERE, capture_output=True, text=True)
+    elapsed = (time.perf_counter() - t) * 1000
+    if r.returncode != 0:
+        raise SystemExit(f"[bench] {' '.join(argv)} failed:\n{r.stderr[-2000:]}")
+    return elapsed, r.stderr
+
+def parse_importtime(stderr):
+    """
+    Returns [(cumulative_us, module)] for every line of -X importtime output.
+    """
+    out = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, _, rest = line.partition(":")
+        self_us, cum_us, name = (x.strip() for x in rest.split("|", 2))
+        out.append((int(cum_us), name))
+    return out
+
+def best_of(argv, runs):
+    return min(run_once(argv)[0] for _ in range(runs))
+
+def imports_of(argv):
+    return parse_importtime(run_once(argv, importtime=True)[1])
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--runs", type=int, default=5)
+    # light commands take ~15ms; eager imports of the crawl stack cost 200ms+
+    p.add_argument("--budget-ms", type=float, default=40.0,
+                   help="max run time above bare `python -c pass`, for commands without their own budget")
+    p.add_argument("--top", type=int, default=5, help="slowest imports to list per command")
+    args = p.parse_args()
+
+    base_ms = best_of(["-c", "pass"], args.runs)
+    print(f"[bench] bare interpreter: {base_ms:.1f}ms")
+
+    failures = []
+    tmp = tempfile.mkdtemp(prefix="p99bench-")
+    try:
+        run_once(cli_argv(tmp, "stats", ["stats"]))  # create the scratch DB outside the timings
+        results = {
+            cmd: (best_of(cli_argv(tmp, cmd, cli_args), args.runs), imports_of(cli_argv(tmp, cmd, cli_args)))
+            for cmd, (cli_args, _) in LIGHT_COMMANDS.items()
+        }
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    for cmd, (ms, imports) in results.items():
+        budget = LIGHT_COMMANDS[cmd][1] or args.budget_ms
+        over = ms - base_ms
+        names = {name.strip() for _, name in imports}
+        heavy = sorted(m for m in HEAVY_MODULES if m in names)
+
+        status = "ok"
+        if heavy:
+            status = "FAIL (imports " + ", ".join(heavy) + ")"
+        elif over > budget:
+            status = f"FAIL (over {budget:.0f}ms budget)"
+        if status != "ok":
+            failures.append(cmd)
+
+        print(f"[bench] {cmd:<9} {ms:7.1f}ms (+{over:5.1f}ms)  {status}")
+        for cum_us, name in sorted(imports, reverse=True)[:args.top]:
+            print(f"            {cum_us / 1000:6.1f}ms  {name.strip()}")
+
+    if failures:
+        print(f"[bench] startup regression in: {', '.join(failures)}")
+        sys.exit(1)
+    print("[bench] all light commands within budget")
+
+if __name__ == "__main__":
+    main()
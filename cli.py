@@ -1,35 +1,155 @@
 import argparse
-from config import DB_PATH, DEFAULT_CATEGORY
-from db import connect, init_db
-from ingest import ingest_category
-from parse import parse_pages
-from export import export_table_to_csv
+from collections import namedtuple
+from config import DB_PATH, DEFAULT_CATEGORY, METRICS_PATH, PROFILE_DIR
+from db import connect, init_db, optimize_db
+from metrics import METRICS, print_stats, run_profiled, write_metrics
 
-def main():
-    p = argparse.ArgumentParser(prog="p99wiki")
-    sub = p.add_subparsers(dest="cmd", required=True)
+# Each subcommand imports its implementation inside run(), so light commands
+# (export, stats, ...) never pay for requests/mwparserfromhell at startup.
+# tracked=False commands don't record a run in the metrics file.
+Command = namedtuple("Command", "add_args run help tracked")
+
+def add_ingest_args(p):
+    p.add_argument("--category", default=DEFAULT_CATEGORY)
+    p.add_argument("--max-pages", type=int, default=0)
+    p.add_argument("--recursive", action="store_true", help="also walk subcategories")
+    p.add_argument("--max-depth", type=int, default=None)
+    p.add_argument("--retry-failed", action="store_true",
+                   help="only retry titles left in the failed-fetch queue")
+
+def run_ingest(conn, args):
+    from ingest import ingest_category, retry_failed
+    if args.retry_failed:
+        retry_failed(conn)
+    else:
+        ingest_category(conn, args.category, args.max_pages, args.recursive, args.max_depth)
+
+def add_parse_args(p):
+    p.add_argument("--force", action="store_true", help="reparse pages whose revision was already parsed")
+
+def run_parse(conn, args):
+    from parse import parse_pages
+    parse_pages(conn, force=args.force)
+
+def add_derive_args(p):
+    pass
+
+def run_derive(conn, args):
+    from derive import derive_core
+    derive_core(conn)
+
+def add_sync_args(p):
+    p.add_argument("--category", default=DEFAULT_CATEGORY)
+    p.add_argument("--max-pages", type=int, default=0)
+    p.add_argument("--refetch", action="store_true", help="refetch pages we already have")
+    p.add_argument("--recursive", action="store_true", help="also walk subcategories")
+    p.add_argument("--max-depth", type=int, default=None)
+    p.add_argument("--delta", action="store_true",
+                   help="only refresh pages changed since the last delta sync (recentchanges)")
+
+def run_sync(conn, args):
+    from sync import delta_sync, sync_category
+    if args.delta:
+        delta_sync(conn, args.category)
+    else:
+        sync_category(conn, args.category, args.max_pages, args.refetch, args.recursive, args.max_depth)
+
+def add_import_dump_args(p):
+    p.add_argument("path", help="MediaWiki XML export (.xml, .xml.bz2 or .xml.gz)")
+    p.add_argument("--category", default=DEFAULT_CATEGORY, help="NPC category pages must link to")
+    p.add_argument("--all-pages", action="store_true", help="import every article, not just NPC pages")
+
+def run_import_dump(conn, args):
+    from dump import import_dump
+    import_dump(conn, args.path, args.category, args.all_pages)
 
-    p_ing = sub.add_parser("ingest")
-    p_ing.add_argument("--category", default=DEFAULT_CATEGORY)
-    p_ing.add_argument("--max-pages", type=int, default=0)
+def add_export_args(p):
+    p.add_argument("--table", default="npc_core")
+    p.add_argument("--out", default="exports/npc_core.csv")
 
-    sub.add_parser("parse")
+def run_export(conn, args):
+    from export import export_table_to_csv
+    export_table_to_csv(conn, args.table, args.out)
 
-    p_exp = sub.add_parser("export")
-    p_exp.add_argument("--table", default="npc_core")
-    p_exp.add_argument("--out", default="exports/npc_core.csv")
+def add_stats_args(p):
+    pass
 
-    args = p.parse_args()
+def run_stats(conn, args):
+    print_stats(METRICS_PATH, conn)
+
+def add_serve_args(p):
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8099)
+
+def run_serve(conn, args):
+    from service import serve
+    conn.close()
+    serve(DB_PATH, args.host, args.port)
+
+def add_compress_args(p):
+    p.add_argument("--retrain", action="store_true")
+    p.add_argument("--no-vacuum", action="store_true")
+
+def run_compress(conn, args):
+    from textstore import compress_pages
+    compress_pages(conn, retrain=args.retrain, vacuum=not args.no_vacuum)
+
+def add_db_args(p):
+    sub = p.add_subparsers(dest="db_cmd", required=True)
+    opt = sub.add_parser("optimize", help="ANALYZE, PRAGMA optimize, checkpoint the WAL and check query plans")
+    opt.add_argument("--vacuum", action="store_true", help="also VACUUM (rewrites the whole file)")
+
+def run_db(conn, args):
+    if args.db_cmd == "optimize":
+        optimize_db(conn, DB_PATH, vacuum=args.vacuum)
+
+COMMANDS = {
+    "ingest": Command(add_ingest_args, run_ingest, "fetch NPC pages from the wiki", True),
+    "parse": Command(add_parse_args, run_parse, "parse stored wikitext into template_kv/npc_core", True),
+    "derive": Command(add_derive_args, run_derive, "rebuild npc_core from stored template_kv (no reparse)", True),
+    "sync": Command(add_sync_args, run_sync, "fetch and parse in one streaming pass", True),
+    "import-dump": Command(add_import_dump_args, run_import_dump, "bulk-load pages from an XML dump, no network", True),
+    "export": Command(add_export_args, run_export, "export a table to CSV", True),
+    "stats": Command(add_stats_args, run_stats, "summarize tables and the last run of each stage", False),
+    "serve": Command(add_serve_args, run_serve, "read-only HTTP/JSON query service over npc_core", False),
+    "compress": Command(add_compress_args, run_compress, "train a wikitext dictionary and re-encode stored pages", True),
+    "db": Command(add_db_args, run_db, "database maintenance (db optimize)", False),
+}
+
+def build_parser():
+    p = argparse.ArgumentParser(prog="p99wiki")
+    p.add_argument("--profile", choices=["cprofile", "tracemalloc"],
+                   help="run the subcommand under a profiler and dump results to " + PROFILE_DIR)
+    sub = p.add_subparsers(dest="cmd", required=True)
+    for name, cmd in COMMANDS.items():
+        cmd.add_args(sub.add_parser(name, help=cmd.help))
+    return p
+
+def main():
+    args = build_parser().parse_args()
+    cmd = COMMANDS[args.cmd]
 
     conn = connect(DB_PATH)
     init_db(conn)
 
-    if args.cmd == "ingest":
-        ingest_category(conn, args.category, args.max_pages)
-    elif args.cmd == "parse":
-        parse_pages(conn)
-    elif args.cmd == "export":
-        export_table_to_csv(conn, args.table, args.out)
+    def run():
+        if not cmd.tracked:
+            cmd.run(conn, args)
+            return
+        with METRICS.stage(args.cmd):
+            cmd.run(conn, args)
+
+    if cmd.tracked:
+        METRICS.reset(args.cmd)
+    try:
+        if args.profile:
+            run_profiled(args.profile, run, PROFILE_DIR, args.cmd)
+        else:
+            run()
+    finally:
+        if cmd.tracked:
+            write_metrics(METRICS_PATH, METRICS.summary())
+            print(f"[metrics] wrote {METRICS_PATH}")
 
 if __name__ == "__main__":
     main()
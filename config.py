@@ -2,5 +2,45 @@ API_URL = "https://wiki.project1999.com/api.php"
 DEFAULT_CATEGORY = "Category:NPCs"
 USER_AGENT = "p99-npc-inventory/0.1 (personal research; respectful rate limit)"
 REQUEST_DELAY_SECS = 0.2
+# Adaptive throttle: speeds up toward MIN_ while latency stays under HEALTHY_LATENCY_SECS
+MIN_REQUEST_DELAY_SECS = 0.05
+MAX_REQUEST_DELAY_SECS = 2.0
+HEALTHY_LATENCY_SECS = 1.0
+MAX_RETRIES = 6
+BACKOFF_BASE_SECS = 1.0
+MAX_BACKOFF_SECS = 120.0
+MAXLAG_SECS = 5
+# Titles in fetch_queue are retried automatically at the end of a run until they've failed this often
+# (`ingest --retry-failed` still retries everything)
+MAX_FETCH_ATTEMPTS = 3
+# Categories listed concurrently per level of the category-tree crawl
+CRAWL_WORKERS = 4
 DB_PATH = "data/p99.sqlite"
+# SQLite tuning (see db.connect / db.connect_readonly): page cache per connection in KiB,
+# memory-mapped I/O window, and WAL pages written before an automatic checkpoint
+DB_WRITE_CACHE_KIB = 64 * 1024
+DB_READ_CACHE_KIB = 32 * 1024
+DB_MMAP_BYTES = 256 * 1024 * 1024
+DB_WAL_AUTOCHECKPOINT = 4000
 PARSE_VERSION = "v0.1"
+# pages.wikitext is stored deflate-compressed with a dictionary trained by `cli.py compress`
+COMPRESS_WIKITEXT = True
+WIKITEXT_DICT_SIZE = 32 * 1024
+WIKITEXT_DICT_SAMPLE = 500
+# cli.py sync: pages buffered between the fetch thread and the parser, and rows per transaction
+SYNC_QUEUE_SIZE = 64
+SYNC_BATCH_SIZE = 100
+SYNC_FLUSH_SECS = 5.0
+# cli.py import-dump: pages per transaction
+IMPORT_BATCH_SIZE = 500
+# cli.py serve: cached responses, max rows per response, and how often to check the DB for changes
+SERVICE_CACHE_SIZE = 2048
+SERVICE_MAX_LIMIT = 1000
+SERVICE_RELOAD_CHECK_SECS = 2.0
+# npc_facts: a param becomes a column once it appears in this share of NPC infoboxes;
+# the column is numeric when this share of its values parse as numbers
+FACTS_MIN_COVERAGE = 0.02
+FACTS_MAX_COLUMNS = 200
+FACTS_NUMERIC_SHARE = 0.9
+METRICS_PATH = "data/metrics.json"
+PROFILE_DIR = "data/profiles"
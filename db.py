@@ -1,6 +1,10 @@
+import os
 import sqlite3
+import time
 from pathlib import Path
 
+from config import DB_MMAP_BYTES, DB_READ_CACHE_KIB, DB_WAL_AUTOCHECKPOINT, DB_WRITE_CACHE_KIB
+
 SCHEMA = """
 CREATE TABLE IF NOT EXISTS pages (
   title TEXT PRIMARY KEY,
@@ -11,17 +15,47 @@ CREATE TABLE IF NOT EXISTS pages (
   fetched_at TEXT DEFAULT (datetime('now'))
 );
 
-CREATE TABLE IF NOT EXISTS template_kv (
-  title TEXT,
-  template_name TEXT,
-  param_name TEXT,
-  param_value TEXT,
-  fetched_at TEXT DEFAULT (datetime('now'))
+-- template_kv is stored interned: titles, template names and param names live
+-- in small dimension tables and kv_values holds integer keys + the value,
+-- clustered by title. The template_kv view keeps the old flat shape for readers.
+CREATE TABLE IF NOT EXISTS kv_titles (
+  title_id INTEGER PRIMARY KEY,
+  title TEXT NOT NULL UNIQUE,
+  revision_id INTEGER,  -- pages.revision_id the kv rows were extracted from
+  parsed_at TEXT DEFAULT (datetime('now'))
+);
+
+CREATE TABLE IF NOT EXISTS kv_templates (
+  template_id INTEGER PRIMARY KEY,
+  name TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS kv_params (
+  param_id INTEGER PRIMARY KEY,
+  name TEXT NOT NULL UNIQUE
 );
 
-CREATE INDEX IF NOT EXISTS idx_template_kv_title ON template_kv(title);
-CREATE INDEX IF NOT EXISTS idx_template_kv_template ON template_kv(template_name);
-CREATE INDEX IF NOT EXISTS idx_template_kv_param ON template_kv(param_name);
+CREATE TABLE IF NOT EXISTS kv_values (
+  title_id INTEGER NOT NULL,
+  seq INTEGER NOT NULL,
+  template_id INTEGER NOT NULL,
+  param_id INTEGER NOT NULL,
+  param_value TEXT,
+  PRIMARY KEY (title_id, seq)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS idx_kv_values_param ON kv_values(param_id, template_id);
+
+CREATE VIEW IF NOT EXISTS template_kv AS
+  SELECT t.title AS title,
+         tp.name AS template_name,
+         p.name AS param_name,
+         v.param_value AS param_value,
+         t.parsed_at AS fetched_at
+  FROM kv_values v
+  JOIN kv_titles t ON t.title_id = v.title_id
+  JOIN kv_templates tp ON tp.template_id = v.template_id
+  JOIN kv_params p ON p.param_id = v.param_id;
 
 CREATE TABLE IF NOT EXISTS npc_core (
   title TEXT PRIMARY KEY,
@@ -38,15 +72,217 @@ CREATE TABLE IF NOT EXISTS npc_core (
   parse_version TEXT,
   parsed_at TEXT DEFAULT (datetime('now'))
 );
+
+-- Wide pivot of template_kv with one column per common infobox param; the
+-- real column set is inferred and the table rebuilt by facts.refresh_facts.
+CREATE TABLE IF NOT EXISTS npc_facts (
+  title TEXT PRIMARY KEY,
+  template TEXT
+);
+
+-- Params seen in NPC infoboxes when npc_facts was last rebuilt, and the
+-- column each feeds (NULL: below coverage); lets refresh_facts skip re-inferring.
+CREATE TABLE IF NOT EXISTS facts_params (
+  param_id INTEGER PRIMARY KEY,
+  column_name TEXT
+);
+
+CREATE TABLE IF NOT EXISTS category_members (
+  category TEXT,
+  title TEXT,
+  ns INTEGER,
+  seen_at TEXT DEFAULT (datetime('now')),
+  PRIMARY KEY (category, title)
+);
+
+CREATE INDEX IF NOT EXISTS idx_category_members_title ON category_members(title);
+
+CREATE TABLE IF NOT EXISTS wikitext_dicts (
+  dict_id INTEGER PRIMARY KEY,
+  data BLOB,
+  created_at TEXT DEFAULT (datetime('now')),
+  seq INTEGER  -- training order; the highest is the current dictionary
+);
+
+CREATE TABLE IF NOT EXISTS sync_state (
+  key TEXT PRIMARY KEY,
+  value TEXT,
+  updated_at TEXT DEFAULT (datetime('now'))
+);
+
+CREATE TABLE IF NOT EXISTS fetch_queue (
+  title TEXT PRIMARY KEY,
+  attempts INTEGER DEFAULT 0,
+  last_error TEXT,
+  queued_at TEXT DEFAULT (datetime('now'))
+);
 """
 
-def connect(db_path: str) -> sqlite3.Connection:
+class Connection(sqlite3.Connection):
+    """
+    Writer connection that can carry per-connection caches: textstore keeps
+    the current wikitext dictionary id here instead of looking it up per page.
+    """
+    wikitext_dict_id = None
+
+def connect(db_path: str) -> Connection:
+    """
+    Writer connection for the CLI (ingest/parse/sync): WAL with NORMAL sync,
+    a large page cache, in-memory temp tables and a bigger autocheckpoint so
+    bulk upserts aren't interrupted by a checkpoint every 1000 pages.
+    """
     Path(db_path).parent.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(db_path)
+    conn = sqlite3.connect(db_path, factory=Connection)
     conn.execute("PRAGMA journal_mode=WAL;")
     conn.execute("PRAGMA synchronous=NORMAL;")
+    conn.execute(f"PRAGMA cache_size=-{DB_WRITE_CACHE_KIB};")
+    conn.execute("PRAGMA temp_store=MEMORY;")
+    conn.execute(f"PRAGMA mmap_size={DB_MMAP_BYTES};")
+    conn.execute(f"PRAGMA wal_autocheckpoint={DB_WAL_AUTOCHECKPOINT};")
+    return conn
+
+def connect_readonly(db_path: str, check_same_thread: bool = True) -> sqlite3.Connection:
+    """
+    Read-only connection for the viewers and the query service. Opened with
+    mode=ro so it can never create or modify the database, and reads through
+    mmap instead of copying pages into the cache.
+    """
+    uri = Path(db_path).resolve().as_uri() + "?mode=ro"
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=check_same_thread)
+    conn.execute("PRAGMA query_only=ON;")
+    conn.execute(f"PRAGMA cache_size=-{DB_READ_CACHE_KIB};")
+    conn.execute("PRAGMA temp_store=MEMORY;")
+    conn.execute(f"PRAGMA mmap_size={DB_MMAP_BYTES};")
     return conn
 
 def init_db(conn: sqlite3.Connection) -> None:
+    legacy = _detach_legacy_template_kv(conn)
     conn.executescript(SCHEMA)
+    if legacy:
+        _migrate_legacy_template_kv(conn)
+    _add_missing_columns(conn)
     conn.commit()
+
+def _add_missing_columns(conn: sqlite3.Connection) -> None:
+    # columns added to existing tables after their first release
+    cols = {r[1] for r in conn.execute("PRAGMA table_info(kv_titles)").fetchall()}
+    if "revision_id" not in cols:
+        conn.execute("ALTER TABLE kv_titles ADD COLUMN revision_id INTEGER")
+    cols = {r[1] for r in conn.execute("PRAGMA table_info(wikitext_dicts)").fetchall()}
+    if "seq" not in cols:
+        # best guess at the training order of existing dictionaries
+        conn.execute("ALTER TABLE wikitext_dicts ADD COLUMN seq INTEGER")
+        conn.execute("""
+            UPDATE wikitext_dicts SET seq = (
+              SELECT COUNT(*) FROM wikitext_dicts d
+              WHERE d.created_at < wikitext_dicts.created_at
+                 OR (d.created_at = wikitext_dicts.created_at AND d.dict_id <= wikitext_dicts.dict_id))
+        """)
+
+def _detach_legacy_template_kv(conn: sqlite3.Connection) -> bool:
+    row = conn.execute("SELECT type FROM sqlite_master WHERE name = 'template_kv'").fetchone()
+    if not row or row[0] != "table":
+        return False
+    conn.execute("ALTER TABLE template_kv RENAME TO template_kv_legacy")
+    for idx in ("idx_template_kv_title", "idx_template_kv_template", "idx_template_kv_param"):
+        conn.execute(f"DROP INDEX IF EXISTS {idx}")
+    return True
+
+def _migrate_legacy_template_kv(conn: sqlite3.Connection) -> None:
+    n = conn.execute("SELECT COUNT(*) FROM template_kv_legacy").fetchone()[0]
+    print(f"[db] migrating {n} template_kv rows to interned storage")
+    conn.executescript("""
+        INSERT OR IGNORE INTO kv_titles (title, parsed_at)
+          SELECT title, MAX(fetched_at) FROM template_kv_legacy WHERE title IS NOT NULL GROUP BY title;
+        -- pages without templates only have an npc_core row; keep them parsed too
+        INSERT OR IGNORE INTO kv_titles (title, parsed_at)
+          SELECT title, parsed_at FROM npc_core;
+        INSERT OR IGNORE INTO kv_templates (name)
+          SELECT DISTINCT COALESCE(template_name, '') FROM template_kv_legacy;
+        INSERT OR IGNORE INTO kv_params (name)
+          SELECT DISTINCT COALESCE(param_name, '') FROM template_kv_legacy;
+        INSERT INTO kv_values (title_id, seq, template_id, param_id, param_value)
+          SELECT t.title_id,
+                 ROW_NUMBER() OVER (PARTITION BY l.title ORDER BY l.rowid),
+                 tp.template_id,
+                 p.param_id,
+                 l.param_value
+          FROM template_kv_legacy l
+          JOIN kv_titles t ON t.title = l.title
+          JOIN kv_templates tp ON tp.name = COALESCE(l.template_name, '')
+          JOIN kv_params p ON p.name = COALESCE(l.param_name, '');
+        DROP TABLE template_kv_legacy;
+    """)
+    print("[db] template_kv migrated; run VACUUM (e.g. `cli.py compress`) to reclaim space")
+
+# sync_state key: recentchanges timestamp the next `sync --delta` starts from
+RC_MARK = "recentchanges_since"
+
+def get_state(conn: sqlite3.Connection, key: str):
+    row = conn.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+def set_state(conn: sqlite3.Connection, key: str, value: str) -> None:
+    conn.execute("""
+        INSERT INTO sync_state (key, value) VALUES (?, ?)
+        ON CONFLICT(key) DO UPDATE SET value=excluded.value, updated_at=datetime('now')
+    """, (key, value))
+    conn.commit()
+
+# Queries the viewers run on every page load / row click; `db optimize` shows
+# their plans. The last field names the tables (as aliased in the plan) that
+# must be reached through an index -- a full SCAN of one is a regression.
+# Scanning the tiny kv_templates/kv_params dimensions is fine.
+HOT_QUERIES = [
+    ("npc_core (viewer load)", "SELECT * FROM npc_core", (), ()),
+    ("template_kv by title",
+     "SELECT template_name, param_name, param_value FROM template_kv WHERE title = ? ORDER BY template_name, param_name",
+     ("",), ("t", "v")),
+    ("pages by title", "SELECT wikitext FROM pages WHERE title = ?", ("",), ("pages",)),
+]
+
+def file_size(db_path: str) -> int:
+    """
+    Main database file plus its WAL, i.e. what the database takes on disk.
+    """
+    return sum(os.path.getsize(p) for p in (db_path, db_path + "-wal") if os.path.exists(p))
+
+def check_query_plans(conn: sqlite3.Connection) -> list:
+    """
+    Prints EXPLAIN QUERY PLAN for HOT_QUERIES; returns names of indexed queries that scan.
+    """
+    bad = []
+    for name, sql, params, indexed in HOT_QUERIES:
+        plan = [r[3] for r in conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()]
+        scans = [d for d in plan if d.split(" ")[:2] in (["SCAN", t] for t in indexed)]
+        print(f"[db] {name}:{'  <-- full scan' if scans else ''}")
+        for detail in plan:
+            print(f"       {detail}")
+        if scans:
+            bad.append(name)
+    return bad
+
+def optimize_db(conn: sqlite3.Connection, db_path: str, vacuum: bool = False) -> None:
+    """
+    Refreshes planner statistics, folds the WAL back into the main file and
+    optionally VACUUMs, then checks the hot viewer queries still use indexes.
+    """
+    t = time.perf_counter()
+    size_before = file_size(db_path)
+
+    conn.execute("ANALYZE")
+    conn.execute("PRAGMA optimize")
+    conn.commit()
+    if vacuum:
+        conn.execute("VACUUM")
+    busy, wal_pages, moved = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+    if busy:
+        print(f"[db] checkpoint incomplete ({moved}/{wal_pages} WAL pages); a reader is holding the WAL open")
+
+    size_after = file_size(db_path)
+    print(f"[db] optimized in {time.perf_counter() - t:.1f}s"
+          f"{' (with VACUUM)' if vacuum else ''}: {size_before / 1e6:.1f} MB -> {size_after / 1e6:.1f} MB")
+
+    bad = check_query_plans(conn)
+    if bad:
+        print(f"[db] warning: full table scans in {', '.join(bad)}")
@@ -0,0 +1,191 @@
+import time
+from itertools import groupby
+from config import PARSE_VERSION
+from facts import refresh_facts
+from metrics import METRICS
+from normalize import normalize_int, parse_level_range
+
+# npc_core is derived from the extracted template rows (template_kv) by the
+# heuristics below. They change far more often than extraction does, so
+# `cli.py derive` can re-run them over the stored rows without touching wikitext.
+
+NPCISH_TEMPLATE_HINTS = ("npc", "mob", "infobox", "creature")
+
+LEVEL_KEYS = ("level", "lvl", "minlevel", "maxlevel", "level_range")
+HP_KEYS = ("hp", "hitpoints", "hit_points")
+AC_KEYS = ("ac", "armorclass", "armor_class")
+ATK_KEYS = ("atk", "attack", "attackrating")
+ZONE_KEYS = ("zone", "location", "loc", "region")
+RACE_KEYS = ("race",)
+CLASS_KEYS = ("class",)
+ID_KEYS = ("npc_id", "id")
+
+def pick_npc_core_from_templates(template_rows):
+    """
+    template_rows: iterable of (template_name, param_name, param_value)
+    Returns dict suitable for npc_core.
+    We scan for the most npc-ish template first; fall back to anything containing level/hp.
+    """
+    # Group by template
+    by_t = {}
+    for tn, pn, pv in template_rows:
+        by_t.setdefault(tn, []).append((pn, pv))
+
+    # Rank templates
+    ranked = sorted(
+        by_t.items(),
+        key=lambda kv: (
+            0 if any(h in kv[0].lower() for h in NPCISH_TEMPLATE_HINTS) else 1,
+            -sum(1 for (pn, _) in kv[1] if pn.strip().lower() in LEVEL_KEYS + HP_KEYS),
+        )
+    )
+
+    best = None
+    best_name = None
+    for tn, params in ranked:
+        lower_map = {pn.strip().lower(): pv for pn, pv in params}
+        has_level = any(k in lower_map for k in LEVEL_KEYS)
+        has_hp = any(k in lower_map for k in HP_KEYS)
+        if has_level or has_hp:
+            best = lower_map
+            best_name = tn
+            break
+
+    if not best:
+        return {}
+
+    # Level
+    lvl_min = lvl_max = None
+    for k in LEVEL_KEYS:
+        if k in best:
+            if k in ("minlevel", "maxlevel"):
+                # if both exist, use them; otherwise set one
+                if k == "minlevel":
+                    lvl_min = normalize_int(best[k])
+                else:
+                    lvl_max = normalize_int(best[k])
+            else:
+                a, b = parse_level_range(best[k])
+                lvl_min, lvl_max = a, b
+            break
+
+    if lvl_min is not None and lvl_max is None:
+        lvl_max = lvl_min
+    if lvl_max is not None and lvl_min is None:
+        lvl_min = lvl_max
+
+    # HP
+    hp = None
+    for k in HP_KEYS:
+        if k in best:
+            hp = normalize_int(best[k])
+            break
+
+    ac = None
+    for k in AC_KEYS:
+        if k in best:
+            ac = normalize_int(best[k])
+            break
+
+    atk = None
+    for k in ATK_KEYS:
+        if k in best:
+            atk = normalize_int(best[k])
+            break
+
+    zone = None
+    for k in ZONE_KEYS:
+        if k in best:
+            zone = str(best[k]).strip()
+            break
+
+    race = None
+    for k in RACE_KEYS:
+        if k in best:
+            race = str(best[k]).strip()
+            break
+
+    cls = None
+    for k in CLASS_KEYS:
+        if k in best:
+            cls = str(best[k]).strip()
+            break
+
+    npc_id = None
+    for k in ID_KEYS:
+        if k in best:
+            npc_id = normalize_int(best[k])
+            break
+
+    return {
+        "level_min": lvl_min,
+        "level_max": lvl_max,
+        "hp": hp,
+        "ac": ac,
+        "atk": atk,
+        "zone": zone,
+        "race": race,
+        "class": cls,
+        "npc_id": npc_id,
+        "parsed_from_template": best_name,
+        "parse_version": PARSE_VERSION,
+    }
+
+CORE_COLUMNS = ("level_min", "level_max", "hp", "ac", "atk", "zone", "race", "class", "npc_id",
+                "parsed_from_template", "parse_version")
+
+def write_core(cur, title_cores):
+    """
+    Upserts npc_core rows; title_cores: iterable of (title, core dict).
+    """
+    cur.executemany(f"""
+        INSERT INTO npc_core (title, {', '.join(CORE_COLUMNS)})
+        VALUES (?{', ?' * len(CORE_COLUMNS)})
+        ON CONFLICT(title) DO UPDATE SET
+            {', '.join(f'{c}=excluded.{c}' for c in CORE_COLUMNS)},
+            parsed_at=datetime('now')
+    """, [(title, *(core.get(c) for c in CORE_COLUMNS)) for title, core in title_cores])
+
+def iter_stored_templates(conn):
+    """
+    Yields (title, [(template_name, param_name, param_value), ...]) for every
+    parsed title still in pages, in extraction order, from one ordered scan of
+    the kv tables. Titles without any templates yield an empty list.
+    """
+    rows = conn.execute("""
+        SELECT t.title, tp.name, p.name, v.param_value
+        FROM kv_titles t
+        JOIN pages pg ON pg.title = t.title
+        LEFT JOIN kv_values v ON v.title_id = t.title_id
+        LEFT JOIN kv_templates tp ON tp.template_id = v.template_id
+        LEFT JOIN kv_params p ON p.param_id = v.param_id
+        ORDER BY t.title_id, v.seq
+    """)
+    for title, group in groupby(rows, key=lambda r: r[0]):
+        yield title, [(tn, pn, pv) for _, tn, pn, pv in group if tn is not None]
+
+def derive_core(conn, batch: int = 5000):
+    """
+    Rebuilds npc_core from the stored template rows. Rows for titles gone from
+    pages are dropped, then npc_facts is rebuilt since the chosen template may
+    have changed.
+    """
+    t = time.perf_counter()
+    cur = conn.cursor()
+    n = 0
+    with METRICS.db_write():
+        cur.execute("DELETE FROM npc_core WHERE title NOT IN (SELECT title FROM pages)")
+        chunk = []
+        for title, template_rows in iter_stored_templates(conn):
+            chunk.append((title, pick_npc_core_from_templates(template_rows)))
+            if len(chunk) >= batch:
+                write_core(cur, chunk)
+                n += len(chunk)
+                chunk = []
+        write_core(cur, chunk)
+        n += len(chunk)
+        conn.commit()
+    METRICS.count("npcs_derived", n)
+
+    print(f"[derive] derived {n} npc_core rows in {time.perf_counter() - t:.2f}s")
+    refresh_facts(conn)
@@ -0,0 +1,187 @@
+import bz2
+import gzip
+import re
+import time
+import xml.etree.ElementTree as ET
+from config import DEFAULT_CATEGORY, IMPORT_BATCH_SIZE
+from db import RC_MARK, get_state, set_state
+from metrics import METRICS
+from textstore import encode_wikitext
+
+CATEGORY_LINK = re.compile(r"\[\[\s*Category\s*:\s*([^\]|#]+)", re.IGNORECASE)
+# {{Namedmobpage ...}}, {{NPC ...}}: the templates NPC pages are built from
+NPC_TEMPLATE = re.compile(r"\{\{\s*[^|}]*(?:npc|mob)", re.IGNORECASE)
+
+# Canonical namespace prefixes, for exports older than schema 0.6 whose pages
+# have no <ns>; <siteinfo><namespaces> adds the wiki's own names on top
+CANONICAL_NAMESPACES = {
+    "Media": -2, "Special": -1, "Talk": 1, "User": 2, "User talk": 3, "Project": 4, "Project talk": 5,
+    "File": 6, "Image": 6, "File talk": 7, "Image talk": 7, "MediaWiki": 8, "MediaWiki talk": 9,
+    "Template": 10, "Template talk": 11, "Help": 12, "Help talk": 13, "Category": 14, "Category talk": 15,
+}
+
+def open_dump(path: str):
+    if path.endswith(".bz2"):
+        return bz2.open(path, "rb")
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+def _tag(elem):
+    return elem.tag.rsplit("}", 1)[-1]
+
+def _child_text(elem, name):
+    for c in elem:
+        if _tag(c) == name:
+            return c.text
+    return None
+
+def namespace_of(title: str, namespaces: dict) -> int:
+    prefix, sep, _ = title.partition(":")
+    if not sep:
+        return 0
+    return namespaces.get(" ".join(prefix.replace("_", " ").split()), 0)
+
+def iter_dump_pages(f):
+    """
+    Streams <page> elements out of a MediaWiki XML export (Special:Export or a
+    database dump, any schema version) and yields one dict per page with its
+    newest revision. Revisions are cleared as they're read, keeping only the
+    newest one's id, timestamp and text, and each page is cleared once handled,
+    so memory stays flat however big the dump or its page histories are.
+    """
+    root = None
+    namespaces = dict(CANONICAL_NAMESPACES)
+    newest = None  # (rev_id, ts, text) of the current page
+    for event, elem in ET.iterparse(f, events=("start", "end")):
+        if root is None:
+            root = elem
+        if event != "end":
+            continue
+        tag = _tag(elem)
+        if tag == "namespace" and elem.text and elem.get("key"):
+            namespaces[elem.text.strip()] = int(elem.get("key"))
+            continue
+        if tag == "revision":
+            rev_id = int(_child_text(elem, "id") or 0)
+            if newest is None or rev_id > newest[0]:
+                newest = (rev_id, _child_text(elem, "timestamp"), _child_text(elem, "text"))
+            elem.clear()
+            continue
+        if tag != "page":
+            continue
+
+        page = {"title": None, "ns": None, "pageid": None, "redirect": False}
+        for c in elem:
+            tag = _tag(c)
+            if tag == "title":
+                page["title"] = c.text
+            elif tag == "ns":
+                page["ns"] = int(c.text)
+            elif tag == "id":
+                page["pageid"] = int(c.text)
+            elif tag == "redirect":
+                page["redirect"] = True
+
+        root.clear()
+        revision, newest = newest, None
+        if revision is None or not page["title"]:
+            continue
+        rev_id, ts, text = revision
+        text = text or ""
+        if page["ns"] is None:
+            page["ns"] = namespace_of(page["title"], namespaces)
+        if text.lstrip()[:9].upper() == "#REDIRECT":
+            page["redirect"] = True  # pre-0.5 exports have no <redirect> element
+        yield dict(page, revision_id=rev_id, revision_ts=ts, wikitext=text)
+
+def _category_name(name: str) -> str:
+    name = " ".join(name.replace("_", " ").split())
+    return "Category:" + name[:1].upper() + name[1:]
+
+def _write_batch(conn, batch):
+    """
+    Upserts a batch of dump pages, leaving rows we already hold at the same or
+    a newer revision untouched. Returns how many rows were written.
+    """
+    cur = conn.cursor()
+    with METRICS.db_write():
+        before = conn.total_changes
+        cur.executemany("""
+            INSERT INTO pages (title, pageid, revision_id, revision_ts, wikitext)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(title) DO UPDATE SET
+                pageid=excluded.pageid,
+                revision_id=excluded.revision_id,
+                revision_ts=excluded.revision_ts,
+                wikitext=excluded.wikitext,
+                fetched_at=datetime('now')
+            WHERE pages.revision_id IS NULL OR excluded.revision_id > pages.revision_id
+        """, [
+            (p["title"], p["pageid"], p["revision_id"], p["revision_ts"], encode_wikitext(conn, p["wikitext"]))
+            for p in batch
+        ])
+        written = conn.total_changes - before
+        cur.executemany(
+            "INSERT OR IGNORE INTO category_members (category, title, ns) VALUES (?, ?, ?)",
+            [(c, p["title"], p["ns"]) for p in batch for c in p["categories"]],
+        )
+        conn.commit()
+    batch.clear()
+    return written
+
+def import_dump(conn, path: str, category: str = DEFAULT_CATEGORY, all_pages: bool = False):
+    """
+    Bulk-loads `pages` from an XML dump instead of crawling api.php. Only
+    articles (ns 0, not redirects) are kept, and unless all_pages=True only NPC
+    pages: titles already listed in category_members, pages linking to
+    `category` or a subcategory we've crawled, or pages using an NPC template.
+    Category links found this way are recorded in category_members.
+
+    The delta-sync high-water mark is moved back to the newest revision in the
+    dump, so `sync --delta` picks up edits made after the dump was generated.
+    """
+    t = time.perf_counter()
+    known = set(r[0] for r in conn.execute("SELECT title FROM category_members WHERE ns = 0").fetchall())
+    tracked = {category}
+    tracked.update(r[0] for r in conn.execute("SELECT DISTINCT title FROM category_members WHERE ns = 14").fetchall())
+
+    # where `sync --delta` would start today: the stored mark, or else the oldest fetch
+    mark = get_state(conn, RC_MARK)
+    if not mark:
+        oldest = conn.execute("SELECT MIN(fetched_at) FROM pages").fetchone()[0]
+        mark = oldest.replace(" ", "T") + "Z" if oldest else None
+
+    seen = kept = written = 0
+    newest = None
+    batch = []
+    with open_dump(path) as f:
+        for page in iter_dump_pages(f):
+            seen += 1
+            if page["revision_ts"] and (newest is None or page["revision_ts"] > newest):
+                newest = page["revision_ts"]
+            if page["ns"] != 0 or page["redirect"]:
+                continue
+            text = page["wikitext"]
+            cats = {_category_name(c) for c in CATEGORY_LINK.findall(text)} & tracked
+            if not all_pages and not (cats or page["title"] in known or NPC_TEMPLATE.search(text)):
+                continue
+
+            page["categories"] = cats
+            batch.append(page)
+            kept += 1
+            METRICS.count("pages_imported")
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                written += _write_batch(conn, batch)
+                print(f"[dump] {seen} pages read, {kept} kept… latest={page['title']}")
+        written += _write_batch(conn, batch)
+
+    if newest:
+        mark = min(mark, newest) if mark else newest
+        set_state(conn, RC_MARK, mark)
+        print(f"[dump] newest revision {newest}; delta sync will resume from {mark}")
+
+    skipped = kept - written
+    print(f"[dump] {seen} pages read, {kept} NPC pages, {written} written, "
+          f"{skipped} already up to date in {time.perf_counter() - t:.1f}s")
+    print("[dump] run `cli.py parse` to extract them (and `cli.py compress` on a fresh database)")
@@ -1,12 +1,20 @@
 import csv
 from pathlib import Path
+from metrics import METRICS
+from textstore import decode_wikitext
 
 def export_table_to_csv(conn, table: str, out_path: str):
     Path(out_path).parent.mkdir(parents=True, exist_ok=True)
     cur = conn.execute(f"SELECT * FROM {table}")
     cols = [d[0] for d in cur.description]
+    rows = cur.fetchall()
+    if table == "pages":
+        # wikitext may be stored compressed; export it as text
+        i = cols.index("wikitext")
+        rows = [r[:i] + (decode_wikitext(conn, r[i]),) + r[i + 1:] for r in rows]
     with open(out_path, "w", newline="", encoding="utf-8") as f:
         w = csv.writer(f)
         w.writerow(cols)
-        w.writerows(cur.fetchall())
+        w.writerows(rows)
+    METRICS.count("rows_exported", len(rows))
     print(f"[export] wrote {out_path}")
@@ -0,0 +1,178 @@
+import re
+import time
+from config import FACTS_MAX_COLUMNS, FACTS_MIN_COVERAGE, FACTS_NUMERIC_SHARE
+
+# npc_facts is a wide pivot of template_kv: one row per npc_core title, one
+# column per param that shows up often enough in the NPC's own infobox
+# template (npc_core.parsed_from_template). Columns and their types are derived
+# from the data on a full rebuild and remembered in facts_params; after that
+# only reparsed titles are rewritten, unless they bring in a param the last
+# inference never saw.
+
+FIXED_COLUMNS = ("title", "template")
+
+_CLEAN = "REPLACE(TRIM(v.param_value), ',', '')"
+_IS_INT = f"({_CLEAN} != '' AND {_CLEAN} NOT GLOB '*[^0-9]*')"
+_IS_REAL = f"({_CLEAN} GLOB '*[0-9]*' AND {_CLEAN} NOT GLOB '*[^0-9.]*' AND {_CLEAN} NOT GLOB '*.*.*')"
+
+# kv rows of each NPC's infobox template; LEFT JOINs keep NPCs without one
+_SOURCE = """
+    FROM npc_core c
+    LEFT JOIN kv_titles t ON t.title = c.title
+    LEFT JOIN kv_templates tp ON tp.name = c.parsed_from_template
+    LEFT JOIN kv_values v ON v.title_id = t.title_id AND v.template_id = tp.template_id
+"""
+
+def column_name(param: str):
+    col = re.sub(r"[^a-z0-9]+", "_", param.lower()).strip("_")
+    if not col:
+        return None
+    if col[0].isdigit():
+        col = "p_" + col
+    if col in FIXED_COLUMNS:
+        col += "_"
+    return col
+
+def infer_columns(conn):
+    """
+    Returns ([(column, type, [param_id, ...])], {param_id, ...}): the params
+    present in at least FACTS_MIN_COVERAGE of NPCs, most common first, and every
+    param seen in an infobox. Params that normalize to the same column name
+    (HP / hp) share it. A column is INTEGER/REAL when at least
+    FACTS_NUMERIC_SHARE of its non-empty values look like one.
+    """
+    total = conn.execute("SELECT COUNT(*) FROM npc_core WHERE parsed_from_template IS NOT NULL").fetchone()[0]
+    if not total:
+        return [], set()
+
+    stats = conn.execute(f"""
+        SELECT p.name, v.param_id, COUNT(DISTINCT v.title_id), COUNT(*), SUM({_IS_INT}), SUM({_IS_REAL})
+        {_SOURCE}
+        JOIN kv_params p ON p.param_id = v.param_id
+        WHERE TRIM(v.param_value) != ''
+        GROUP BY v.param_id
+    """).fetchall()
+
+    cols = {}
+    for name, param_id, titles, values, ints, reals in stats:
+        col = column_name(name)
+        if col is None:
+            continue
+        c = cols.setdefault(col, {"ids": [], "titles": 0, "values": 0, "ints": 0, "reals": 0})
+        c["ids"].append(param_id)
+        c["titles"] += titles
+        c["values"] += values
+        c["ints"] += ints
+        c["reals"] += reals
+
+    out = []
+    for col, c in sorted(cols.items(), key=lambda kv: (-kv[1]["titles"], kv[0])):
+        if c["titles"] / total < FACTS_MIN_COVERAGE:
+            continue
+        if c["ints"] >= FACTS_NUMERIC_SHARE * c["values"]:
+            typ = "INTEGER"
+        elif c["reals"] >= FACTS_NUMERIC_SHARE * c["values"]:
+            typ = "REAL"
+        else:
+            typ = "TEXT"
+        out.append((col, typ, sorted(c["ids"])))
+    return out[:FACTS_MAX_COLUMNS], {r[1] for r in stats}
+
+def _value_expr(typ):
+    # values that don't fit a numeric column become NULL; the raw text stays in template_kv
+    if typ == "INTEGER":
+        return f"CASE WHEN {_IS_INT} THEN CAST({_CLEAN} AS INTEGER) END"
+    if typ == "REAL":
+        return f"CASE WHEN {_IS_REAL} THEN CAST({_CLEAN} AS REAL) END"
+    return "NULLIF(TRIM(v.param_value), '')"
+
+def _pivot_sql(columns, where=""):
+    names = ", ".join(f'"{col}"' for col, _, _ in columns)
+    exprs = ",\n".join(
+        f"MAX(CASE WHEN v.param_id IN ({', '.join(map(str, ids))}) THEN {_value_expr(typ)} END)"
+        for _, typ, ids in columns
+    )
+    return f"""
+        INSERT INTO npc_facts (title, template{', ' + names if columns else ''})
+        SELECT c.title, c.parsed_from_template{', ' + exprs if columns else ''}
+        {_SOURCE}
+        {where}
+        GROUP BY c.title
+    """
+
+def _stored_columns(conn):
+    """
+    The column set npc_facts was last built with, as infer_columns returns it,
+    or None if the param map is missing (first run, or a pre-map database).
+    """
+    ids = {}
+    for param_id, col in conn.execute("SELECT param_id, column_name FROM facts_params").fetchall():
+        if col is not None:
+            ids.setdefault(col, []).append(param_id)
+    cols = [(r[1], r[2]) for r in conn.execute("PRAGMA table_info(npc_facts)").fetchall()
+            if r[1] not in FIXED_COLUMNS]
+    if not ids and not cols:
+        return None if conn.execute("SELECT 1 FROM facts_params LIMIT 1").fetchone() is None else []
+    if {col for col, _ in cols} != set(ids):
+        return None
+    return [(col, typ, sorted(ids[col])) for col, typ in cols]
+
+def _has_new_params(conn):
+    # any non-empty infobox param on a dirty title that the last inference never saw
+    return conn.execute(f"""
+        SELECT 1
+        {_SOURCE}
+        WHERE c.title IN (SELECT title FROM facts_dirty)
+          AND TRIM(v.param_value) != ''
+          AND v.param_id NOT IN (SELECT param_id FROM facts_params)
+        LIMIT 1
+    """).fetchone() is not None
+
+def rebuild_facts(conn, columns, params):
+    conn.execute("DROP TABLE IF EXISTS npc_facts")
+    defs = "".join(f',\n  "{col}" {typ}' for col, typ, _ in columns)
+    conn.execute(f"CREATE TABLE npc_facts (\n  title TEXT PRIMARY KEY,\n  template TEXT{defs}\n)")
+    conn.execute(_pivot_sql(columns))
+    for col, typ, _ in columns:
+        if typ != "TEXT":
+            conn.execute(f'CREATE INDEX "idx_npc_facts_{col}" ON npc_facts ("{col}")')
+
+    column_of = {param_id: col for col, _, ids in columns for param_id in ids}
+    conn.execute("DELETE FROM facts_params")
+    conn.executemany("INSERT INTO facts_params (param_id, column_name) VALUES (?, ?)",
+                     ((param_id, column_of.get(param_id)) for param_id in sorted(params)))
+
+def refresh_facts(conn, titles=None):
+    """
+    Brings npc_facts up to date after a parse. titles=None re-infers the
+    columns and rebuilds the whole table; otherwise only those titles are
+    re-pivoted into the stored column set, unless one of them uses a param
+    that set was inferred without, in which case the table is rebuilt anyway.
+    """
+    if titles is not None:
+        titles = list(titles)
+        if not titles:
+            return
+    t = time.perf_counter()
+
+    columns = None
+    if titles is not None:
+        conn.execute("CREATE TEMP TABLE IF NOT EXISTS facts_dirty (title TEXT PRIMARY KEY)")
+        conn.execute("DELETE FROM facts_dirty")
+        conn.executemany("INSERT OR IGNORE INTO facts_dirty (title) VALUES (?)", ((x,) for x in titles))
+        columns = _stored_columns(conn)
+        if columns is not None and _has_new_params(conn):
+            columns = None
+
+    if columns is None:
+        columns, params = infer_columns(conn)
+        rebuild_facts(conn, columns, params)
+        conn.commit()
+        n = conn.execute("SELECT COUNT(*) FROM npc_facts").fetchone()[0]
+        print(f"[facts] rebuilt npc_facts: {n} rows x {len(columns)} columns in {time.perf_counter() - t:.2f}s")
+        return
+
+    conn.execute("DELETE FROM npc_facts WHERE title IN (SELECT title FROM facts_dirty)")
+    conn.execute(_pivot_sql(columns, "WHERE c.title IN (SELECT title FROM facts_dirty)"))
+    conn.commit()
+    print(f"[facts] refreshed {len(titles)} titles in {time.perf_counter() - t:.2f}s")
@@ -1,15 +1,118 @@
-from mediawiki import iter_category_members, fetch_wikitext
+import requests
+from config import MAX_FETCH_ATTEMPTS
+from mediawiki import ApiError, iter_category_members, iter_category_tree, fetch_wikitext
+from metrics import METRICS
+from textstore import encode_wikitext
 
-def ingest_category(conn, category: str, max_pages: int = 0):
+FETCH_ERRORS = (requests.RequestException, ApiError)
+
+def upsert_page(cur, payload):
+    cur.execute("""
+        INSERT INTO pages (title, pageid, revision_id, revision_ts, wikitext)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(title) DO UPDATE SET
+            pageid=excluded.pageid,
+            revision_id=excluded.revision_id,
+            revision_ts=excluded.revision_ts,
+            wikitext=excluded.wikitext,
+            fetched_at=datetime('now')
+    """, (
+        payload["title"],
+        payload["pageid"],
+        payload["revision_id"],
+        payload["revision_ts"],
+        encode_wikitext(cur.connection, payload["wikitext"]),
+    ))
+
+def enqueue_failed(cur, title, error):
+    cur.execute("""
+        INSERT INTO fetch_queue (title, attempts, last_error) VALUES (?, 1, ?)
+        ON CONFLICT(title) DO UPDATE SET
+            attempts=attempts + 1,
+            last_error=excluded.last_error,
+            queued_at=datetime('now')
+    """, (title, str(error)))
+
+def fetch_and_store(conn, title) -> bool:
+    """
+    Fetches one title and upserts it. Failures (after api_get's own retries) go to
+    fetch_queue instead of aborting the crawl. Returns True on success.
+    """
+    cur = conn.cursor()
+    try:
+        payload = fetch_wikitext(title)
+    except FETCH_ERRORS as e:
+        print(f"[ingest] failed {title}: {e} (queued for retry)")
+        METRICS.count("fetch_failures")
+        enqueue_failed(cur, title, e)
+        conn.commit()
+        return False
+
+    with METRICS.db_write():
+        upsert_page(cur, payload)
+        cur.execute("DELETE FROM fetch_queue WHERE title = ?", (title,))
+        conn.commit()
+
+    METRICS.count("pages_fetched")
+    return True
+
+def retry_failed(conn, max_attempts: int = 0):
+    """
+    One pass over fetch_queue. max_attempts=0 means retry everything queued;
+    otherwise titles that have already failed max_attempts times are left for
+    `ingest --retry-failed`.
+    """
+    sql = "SELECT title FROM fetch_queue"
+    if max_attempts:
+        sql += f" WHERE attempts < {int(max_attempts)}"
+    titles = [r[0] for r in conn.execute(sql + " ORDER BY queued_at").fetchall()]
+    if max_attempts:
+        capped = conn.execute("SELECT COUNT(*) FROM fetch_queue WHERE attempts >= ?", (max_attempts,)).fetchone()[0]
+        if capped:
+            print(f"[ingest] {capped} queued titles failed {max_attempts}+ times; use --retry-failed to retry them")
+    if not titles:
+        return
+
+    print(f"[ingest] retrying {len(titles)} queued titles")
+    ok = sum(1 for title in titles if fetch_and_store(conn, title))
+    left = conn.execute("SELECT COUNT(*) FROM fetch_queue").fetchone()[0]
+    print(f"[ingest] retry pass: {ok}/{len(titles)} recovered, {left} still queued")
+
+def iter_category_pages(conn, category: str, recursive: bool = False, max_depth=None):
+    """
+    Yields each article (namespace 0) under category once, recording every
+    membership in category_members along the way. recursive=True also walks
+    subcategories (see iter_category_tree).
+    """
+    if recursive:
+        members = iter_category_tree(category, max_depth)
+    else:
+        members = (dict(m, category=category, new=True) for m in iter_category_members(category))
+
+    cur = conn.cursor()
+    n = 0
+    for m in members:
+        cur.execute("""
+            INSERT INTO category_members (category, title, ns) VALUES (?, ?, ?)
+            ON CONFLICT(category, title) DO UPDATE SET seen_at=datetime('now')
+        """, (m["category"], m["title"], m["ns"]))
+        n += 1
+        if n % 500 == 0:
+            conn.commit()
+        if m["ns"] in (0, None) and m["new"]:
+            yield m
+    conn.commit()
+
+def ingest_category(conn, category: str, max_pages: int = 0, recursive: bool = False, max_depth=None):
     """
     max_pages=0 means no limit.
     """
     cur = conn.cursor()
     count = 0
 
-    for m in iter_category_members(category):
+    for m in iter_category_pages(conn, category, recursive, max_depth):
         title = m["title"]
-        
+
         # Check if we already have this page with a wikitext
         cur.execute("SELECT revision_id FROM pages WHERE title = ? AND wikitext IS NOT NULL AND wikitext != ''", (title,))
         if cur.fetchone():
@@ -18,19 +121,7 @@ def ingest_category(conn, category: str, max_pages: int = 0):
                 print(f"[ingest] skipping {title} (already have it)")
             continue
 
-        payload = fetch_wikitext(title)
-
-        cur.execute("""
-            INSERT INTO pages (title, pageid, revision_id, revision_ts, wikitext)
-            VALUES (?, ?, ?, ?, ?)
-            ON CONFLICT(title) DO UPDATE SET
-                pageid=excluded.pageid,
-                revision_id=excluded.revision_id,
-                revision_ts=excluded.revision_ts,
-                wikitext=excluded.wikitext,
-                fetched_at=datetime('now')
-        """, (payload["title"], payload["pageid"], payload["revision_id"], payload["revision_ts"], payload["wikitext"]))
-        conn.commit()
+        fetch_and_store(conn, title)
 
         count += 1
         if count % 250 == 0:
@@ -39,4 +130,5 @@ def ingest_category(conn, category: str, max_pages: int = 0):
         if max_pages and count >= max_pages:
             break
 
+    retry_failed(conn, MAX_FETCH_ATTEMPTS)
     print(f"[ingest] done: {count} pages")
@@ -0,0 +1,107 @@
+import math
+from bisect import bisect_left, bisect_right
+
+# Ranges wider than this are kept out of the sorted arrays so one "1-60" mob
+# can't widen every lookup window
+WIDE_SPAN = 10
+
+def _level(v):
+    if v is None:
+        return None
+    try:
+        f = float(v)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(f) else int(f)
+
+class LevelIntervalIndex:
+    """
+    Finds NPCs whose [level_min, level_max] range overlaps a player-level window.
+
+    Narrow ranges live in arrays sorted by level_min; an interval starting at s
+    can only reach the window if s >= lo - max_span, so a query is two bisects
+    plus a scan of that slice. Wide ranges are checked linearly (there are few).
+    Positions returned are indexes into the sequences the index was built from.
+    """
+
+    def __init__(self, level_mins, level_maxs):
+        narrow = []
+        self.wide = []
+        for pos, (a, b) in enumerate(zip(level_mins, level_maxs)):
+            a, b = _level(a), _level(b)
+            if a is None and b is None:
+                continue
+            if a is None:
+                a = b
+            if b is None:
+                b = a
+            if a > b:
+                a, b = b, a
+            if b - a > WIDE_SPAN:
+                self.wide.append((a, b, pos))
+            else:
+                narrow.append((a, b, pos))
+
+        narrow.sort()
+        self.starts = [a for a, _, _ in narrow]
+        self.ends = [b for _, b, _ in narrow]
+        self.positions = [p for _, _, p in narrow]
+        self.max_span = max((b - a for a, b, _ in narrow), default=0)
+
+    def __len__(self):
+        return len(self.starts) + len(self.wide)
+
+    def overlapping(self, lo, hi=None):
+        """
+        Sorted positions of every interval that overlaps [lo, hi] (hi defaults to lo).
+        """
+        if hi is None:
+            hi = lo
+        i = bisect_left(self.starts, lo - self.max_span)
+        j = bisect_right(self.starts, hi)
+        ends, positions = self.ends, self.positions
+        out = [positions[k] for k in range(i, j) if ends[k] >= lo]
+        out.extend(p for a, b, p in self.wide if a <= hi and b >= lo)
+        out.sort()
+        return out
+
+def build_level_index(level_mins, level_maxs=None):
+    """
+    level_mins/level_maxs: any sequences (lists, pandas Series); None/NaN are
+    treated as unknown. If level_maxs is omitted each NPC is a single level.
+    """
+    level_mins = list(level_mins)
+    level_maxs = list(level_maxs) if level_maxs is not None else level_mins
+    return LevelIntervalIndex(level_mins, level_maxs)
+
+if __name__ == "__main__":
+    # Quick check against a linear scan: python levelindex.py [db_path]
+    import sys
+    import time
+    from config import DB_PATH
+    from db import connect_readonly
+
+    conn = connect_readonly(sys.argv[1] if len(sys.argv) > 1 else DB_PATH)
+    rows = conn.execute("SELECT level_min, level_max FROM npc_core").fetchall()
+    mins = [r[0] for r in rows]
+    maxs = [r[1] for r in rows]
+
+    t = time.perf_counter()
+    idx = build_level_index(mins, maxs)
+    print(f"[levelindex] built over {len(idx)} ranged NPCs in {(time.perf_counter() - t) * 1000:.2f}ms")
+
+    windows = [(lo, lo + w) for lo in range(1, 66) for w in (0, 2, 5)]
+    t = time.perf_counter()
+    results = [idx.overlapping(lo, hi) for lo, hi in windows]
+    per_query = (time.perf_counter() - t) / len(windows) * 1000
+
+    for (lo, hi), got in zip(windows, results):
+        want = []
+        for pos, (a, b) in enumerate(zip(mins, maxs)):
+            a, b = _level(a), _level(b)
+            a = a if a is not None else b
+            b = b if b is not None else a
+            if a is not None and min(a, b) <= hi and max(a, b) >= lo:
+                want.append(pos)
+        assert got == want, (lo, hi)
+    print(f"[levelindex] {len(windows)} window queries ok, {per_query:.4f}ms/query")
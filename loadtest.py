@@ -0,0 +1,94 @@
+"""
+Load test for the query service (`python cli.py serve`).
+
+    python loadtest.py --url http://127.0.0.1:8099 --threads 16 --requests 5000
+
+Mixes /squishiest and /npcs queries over random levels and real zones, then
+reports throughput and p50/p90/p99 latency.
+"""
+import argparse
+import json
+import random
+import statistics
+import threading
+import time
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+def get(url):
+    with urlopen(url, timeout=30) as r:
+        return r.read()
+
+def make_queries(base, zones, n, seed):
+    rnd = random.Random(seed)
+    out = []
+    for _ in range(n):
+        params = {"level": rnd.randint(1, 60)}
+        if zones and rnd.random() < 0.5:
+            params["zone"] = rnd.choice(zones)
+        path = "/squishiest" if rnd.random() < 0.7 else "/npcs"
+        if path == "/npcs":
+            params["sort"] = rnd.choice(["hp", "rsi", "title"])
+        out.append(f"{base}{path}?{urlencode(params)}")
+    return out
+
+def pct(sorted_vals, p):
+    if not sorted_vals:
+        return None
+    i = min(len(sorted_vals) - 1, int(round(p / 100 * (len(sorted_vals) - 1))))
+    return sorted_vals[i]
+
+def main():
+    p = argparse.ArgumentParser()
+    p.add_argument("--url", default="http://127.0.0.1:8099")
+    p.add_argument("--threads", type=int, default=16)
+    p.add_argument("--requests", type=int, default=5000)
+    p.add_argument("--seed", type=int, default=99)
+    args = p.parse_args()
+
+    base = args.url.rstrip("/")
+    zones = [z["zone"] for z in json.loads(get(base + "/zones"))[:50]]
+    queries = make_queries(base, zones, args.requests, args.seed)
+
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    it = iter(queries)
+
+    def worker():
+        nonlocal errors
+        local = []
+        local_errors = 0
+        while True:
+            with lock:
+                url = next(it, None)
+            if url is None:
+                break
+            t = time.perf_counter()
+            try:
+                get(url)
+            except Exception:
+                local_errors += 1
+                continue
+            local.append((time.perf_counter() - t) * 1000)
+        with lock:
+            latencies.extend(local)
+            errors += local_errors
+
+    t0 = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(args.threads)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+
+    latencies.sort()
+    print(f"[loadtest] {len(latencies)} ok, {errors} errors, {args.threads} threads, {elapsed:.2f}s")
+    print(f"[loadtest] throughput: {len(latencies) / elapsed:.0f} req/s")
+    if latencies:
+        print(f"[loadtest] latency ms: p50 {pct(latencies, 50):.2f}  p90 {pct(latencies, 90):.2f}  "
+              f"p99 {pct(latencies, 99):.2f}  max {latencies[-1]:.2f}  mean {statistics.mean(latencies):.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,123 @@
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
 import requests
-from config import API_URL, USER_AGENT, REQUEST_DELAY_SECS
+from config import (
+    API_URL, USER_AGENT, REQUEST_DELAY_SECS, MIN_REQUEST_DELAY_SECS, MAX_REQUEST_DELAY_SECS,
+    HEALTHY_LATENCY_SECS, MAX_RETRIES, BACKOFF_BASE_SECS, MAX_BACKOFF_SECS, MAXLAG_SECS,
+    CRAWL_WORKERS,
+)
+from metrics import METRICS
 
 SESSION = requests.Session()
 SESSION.headers.update({"User-Agent": USER_AGENT})
 
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+class ApiError(Exception):
+    pass
+
+class Throttle:
+    """
+    Paces requests: the delay shrinks toward min_delay while responses are fast,
+    grows when they are slow, and pauses every caller on 429/503/maxlag.
+    """
+
+    def __init__(self, delay, min_delay, max_delay, healthy_latency):
+        self.delay = delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.healthy_latency = healthy_latency
+        self._next_at = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_at)
+            self._next_at = slot + self.delay
+        if slot > now:
+            time.sleep(slot - now)
+
+    def on_success(self, latency):
+        with self._lock:
+            if latency <= self.healthy_latency:
+                self.delay = max(self.min_delay, self.delay * 0.8)
+            else:
+                self.delay = min(self.max_delay, self.delay * 1.5)
+
+    def on_backoff(self, attempt, retry_after=None):
+        pause = min(MAX_BACKOFF_SECS, BACKOFF_BASE_SECS * (2 ** attempt))
+        if retry_after is not None:
+            pause = max(pause, retry_after)
+        with self._lock:
+            self.delay = min(self.max_delay, max(self.delay * 2, REQUEST_DELAY_SECS))
+            self._next_at = max(self._next_at, time.monotonic() + pause)
+        return pause
+
+THROTTLE = Throttle(REQUEST_DELAY_SECS, MIN_REQUEST_DELAY_SECS, MAX_REQUEST_DELAY_SECS, HEALTHY_LATENCY_SECS)
+
+def parse_retry_after(value):
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
 def api_get(params: dict) -> dict:
+    """
+    GET against api.php, paced by THROTTLE. 429/5xx responses, connection errors
+    and maxlag errors are retried with exponential backoff (honoring Retry-After);
+    after MAX_RETRIES the last error is raised.
+    """
     params = dict(params)
     params["format"] = "json"
-    r = SESSION.get(API_URL, params=params, timeout=30)
-    r.raise_for_status()
-    time.sleep(REQUEST_DELAY_SECS)
-    return r.json()
+    params["maxlag"] = MAXLAG_SECS
+
+    attempt = 0
+    while True:
+        THROTTLE.wait()
+        t = time.perf_counter()
+        try:
+            r = SESSION.get(API_URL, params=params, timeout=30)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt >= MAX_RETRIES:
+                raise
+            pause = THROTTLE.on_backoff(attempt)
+            METRICS.count("http_retries")
+            print(f"[mediawiki] {type(e).__name__}; backing off {pause:.1f}s")
+            attempt += 1
+            continue
+
+        latency = time.perf_counter() - t
+        METRICS.record_request(latency, len(r.content))
+
+        error = None
+        if r.status_code in RETRYABLE_STATUS:
+            error = f"HTTP {r.status_code}"
+        else:
+            r.raise_for_status()
+            data = r.json()
+            if data.get("error", {}).get("code") == "maxlag":
+                error = f"maxlag: {data['error'].get('info')}"
+
+        if error is None:
+            THROTTLE.on_success(latency)
+            return data
+
+        if attempt >= MAX_RETRIES:
+            r.raise_for_status()
+            raise ApiError(error)
+        pause = THROTTLE.on_backoff(attempt, parse_retry_after(r.headers.get("Retry-After")))
+        METRICS.count("http_retries")
+        print(f"[mediawiki] {error}; backing off {pause:.1f}s (delay now {THROTTLE.delay:.2f}s)")
+        attempt += 1
 
 def iter_category_members(category_title: str, namespace: int = 0, limit: int = 500):
     cmcontinue = None
@@ -33,12 +139,115 @@ def iter_category_members(category_title: str, namespace: int = 0, limit: int =
             yield {
                 "title": m.get("title"),
                 "pageid": m.get("pageid"),
+                "ns": m.get("ns"),
             }
 
         cmcontinue = data.get("query-continue", {}).get("categorymembers", {}).get("cmcontinue")
         if not cmcontinue:
             break
 
+def iter_category_tree(root: str, max_depth=None, workers: int = CRAWL_WORKERS):
+    """
+    Breadth-first walk of root and its subcategories (max_depth=None means no limit).
+    Each level of the tree is listed concurrently, at most `workers` categories in
+    flight; a category is only listed once even if it sits under several parents.
+    Yields every membership as {"category", "title", "pageid", "ns", "new"}, where
+    "new" is False for pages/subcategories already seen elsewhere in the tree.
+    """
+    seen = {root}
+    frontier = [root]
+    depth = 0
+
+    def list_members(category):
+        return list(iter_category_members(category, namespace="0|14"))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while frontier:
+            next_frontier = []
+            for category, members in zip(frontier, pool.map(list_members, frontier)):
+                for m in members:
+                    new = m["title"] not in seen
+                    seen.add(m["title"])
+                    if m["ns"] == 14 and new and (max_depth is None or depth < max_depth):
+                        next_frontier.append(m["title"])
+                    yield dict(m, category=category, new=new)
+            frontier = next_frontier
+            depth += 1
+
+def iter_recent_changes(since: str, namespace: int = 0, limit: int = 500):
+    """
+    Edits, page creations and log entries (deletes, moves) since `since`, an ISO
+    timestamp, oldest first.
+    """
+    params = {
+        "action": "query",
+        "list": "recentchanges",
+        "rcstart": since,
+        "rcdir": "newer",
+        "rcnamespace": namespace,
+        "rctype": "edit|new|log",
+        "rcprop": "title|timestamp|ids|loginfo",
+        "rclimit": limit,
+    }
+    while True:
+        data = api_get(params)
+        for rc in data.get("query", {}).get("recentchanges", []):
+            yield rc
+
+        cont = data.get("query-continue", {}).get("recentchanges") or data.get("continue")
+        if not cont:
+            break
+        params = dict(params, **cont)
+
+def oldest_recent_change():
+    """
+    Timestamp of the oldest entry the wiki still keeps in recentchanges (any
+    namespace), or None if the list is empty. Older changes have been purged
+    ($wgRCMaxAge), so a delta from before this point would miss edits.
+    """
+    data = api_get({
+        "action": "query",
+        "list": "recentchanges",
+        "rcdir": "newer",
+        "rcprop": "timestamp",
+        "rclimit": 1,
+    })
+    rcs = data.get("query", {}).get("recentchanges", [])
+    return rcs[0]["timestamp"] if rcs else None
+
+def fetch_categories(titles, categories, batch: int = 50) -> dict:
+    """
+    Returns {title: set of `categories` the page is in}. Titles and categories
+    are both sent 50 at a time, the API's limit for multi-value parameters.
+    """
+    titles = list(titles)
+    categories = list(categories)
+    out = {t: set() for t in titles}
+    for i in range(0, len(titles), batch):
+        chunk = titles[i:i + batch]
+        for j in range(0, len(categories), batch):
+            params = {
+                "action": "query",
+                "prop": "categories",
+                "titles": "|".join(chunk),
+                "clcategories": "|".join(categories[j:j + batch]),
+                "cllimit": 500,
+            }
+            while True:
+                data = api_get(params)
+                query = data.get("query", {})
+                renamed = {n["to"]: n["from"] for n in query.get("normalized", [])}
+                for page in query.get("pages", {}).values():
+                    title = renamed.get(page.get("title"), page.get("title"))
+                    for c in page.get("categories") or []:
+                        out.setdefault(title, set()).add(c["title"])
+
+                cont = data.get("query-continue", {}).get("categories") or data.get("continue")
+                if not cont:
+                    break
+                params = dict(params, **cont)
+    return out
+
 def fetch_wikitext(title: str) -> dict:
     data = api_get({
         "action": "query",
@@ -0,0 +1,233 @@
+import heapq
+import json
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+LATENCY_BUCKETS_MS = (50, 100, 250, 500, 1000, 2500, 5000)
+SLOWEST_PAGES_KEEP = 20
+
+class Metrics:
+    """
+    Process-wide counters for one CLI run. Stages (ingest/parse/export) are
+    timed with `stage()`; the HTTP and DB hooks just bump counters.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self, command=None):
+        self.command = command
+        self.started_at = datetime.now(timezone.utc).isoformat(timespec="seconds")
+        self._t0 = time.perf_counter()
+        self.stages = {}
+        self.counters = {}
+        self.requests = 0
+        self.bytes_fetched = 0
+        self.http_secs = 0.0
+        self.latency_hist = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.pages_parsed = 0
+        self.parse_secs = 0.0
+        self._slowest = []  # min-heap of (secs, title)
+        self.db_writes = 0
+        self.db_write_secs = 0.0
+        self.peak_traced_bytes = None
+
+    @contextmanager
+    def stage(self, name):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + (time.perf_counter() - t)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def record_request(self, secs, nbytes):
+        ms = secs * 1000
+        with self._lock:
+            self.requests += 1
+            self.bytes_fetched += nbytes
+            self.http_secs += secs
+            for i, edge in enumerate(LATENCY_BUCKETS_MS):
+                if ms <= edge:
+                    self.latency_hist[i] += 1
+                    break
+            else:
+                self.latency_hist[-1] += 1
+
+    def record_page_parse(self, title, secs):
+        self.pages_parsed += 1
+        self.parse_secs += secs
+        item = (secs, title)
+        if len(self._slowest) < SLOWEST_PAGES_KEEP:
+            heapq.heappush(self._slowest, item)
+        elif item > self._slowest[0]:
+            heapq.heapreplace(self._slowest, item)
+
+    @contextmanager
+    def db_write(self):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.db_writes += 1
+            self.db_write_secs += time.perf_counter() - t
+
+    def summary(self):
+        elapsed = time.perf_counter() - self._t0
+        hist = {}
+        for i, edge in enumerate(LATENCY_BUCKETS_MS):
+            hist[f"<={edge}ms"] = self.latency_hist[i]
+        hist[f">{LATENCY_BUCKETS_MS[-1]}ms"] = self.latency_hist[-1]
+
+        return {
+            "command": self.command,
+            "started_at": self.started_at,
+            "elapsed_secs": round(elapsed, 3),
+            "stages_secs": {k: round(v, 3) for k, v in self.stages.items()},
+            "counters": dict(self.counters),
+            "http": {
+                "requests": self.requests,
+                "requests_per_sec": round(self.requests / elapsed, 2) if elapsed else None,
+                "bytes_fetched": self.bytes_fetched,
+                "avg_latency_ms": round(self.http_secs / self.requests * 1000, 1) if self.requests else None,
+                "latency_histogram": hist,
+            },
+            "parse": {
+                "pages": self.pages_parsed,
+                "secs": round(self.parse_secs, 3),
+                "avg_ms": round(self.parse_secs / self.pages_parsed * 1000, 2) if self.pages_parsed else None,
+                "slowest_pages": [
+                    {"title": title, "ms": round(secs * 1000, 2)}
+                    for secs, title in sorted(self._slowest, reverse=True)
+                ],
+            },
+            "db": {
+                "writes": self.db_writes,
+                "write_secs": round(self.db_write_secs, 3),
+            },
+            "memory": {
+                "peak_rss_bytes": peak_rss_bytes(),
+                "peak_traced_bytes": self.peak_traced_bytes,
+            },
+        }
+
+METRICS = Metrics()
+
+def peak_rss_bytes():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS reports bytes
+    return rss if sys.platform == "darwin" else rss * 1024
+
+def write_metrics(path: str, summary: dict):
+    """
+    The metrics file keeps the latest run of each command, keyed by command name.
+    """
+    p = Path(path)
+    p.parent.mkdir(parents=True, exist_ok=True)
+    data = load_metrics(path)
+    data.setdefault("runs", {})[summary["command"]] = summary
+    p.write_text(json.dumps(data, indent=2), encoding="utf-8")
+
+def load_metrics(path: str) -> dict:
+    p = Path(path)
+    if not p.exists():
+        return {}
+    try:
+        return json.loads(p.read_text(encoding="utf-8"))
+    except ValueError:
+        return {}
+
+def run_profiled(kind: str, fn, out_dir: str, name: str):
+    """
+    Runs fn() under cProfile or tracemalloc and dumps results into out_dir.
+    """
+    Path(out_dir).mkdir(parents=True, exist_ok=True)
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+
+    if kind == "cprofile":
+        import cProfile
+        import pstats
+        prof = cProfile.Profile()
+        try:
+            return prof.runcall(fn)
+        finally:
+            out = Path(out_dir) / f"{name}-{stamp}.pstats"
+            prof.dump_stats(str(out))
+            print(f"[profile] wrote {out}")
+            pstats.Stats(prof).sort_stats("cumulative").print_stats(25)
+
+    if kind == "tracemalloc":
+        import tracemalloc
+        tracemalloc.start(25)
+        try:
+            return fn()
+        finally:
+            snap = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            METRICS.peak_traced_bytes = peak
+            out = Path(out_dir) / f"{name}-{stamp}.tracemalloc.txt"
+            with open(out, "w", encoding="utf-8") as f:
+                f.write(f"peak traced: {peak} bytes\n\n")
+                for stat in snap.statistics("traceback")[:25]:
+                    f.write(f"{stat.size} bytes in {stat.count} blocks\n")
+                    for line in stat.traceback.format():
+                        f.write(f"  {line}\n")
+                    f.write("\n")
+            print(f"[profile] wrote {out} (peak traced {peak} bytes)")
+
+    raise ValueError(f"unknown profiler: {kind}")
+
+def print_stats(metrics_path: str, conn=None):
+    data = load_metrics(metrics_path)
+    runs = data.get("runs", {})
+
+    if conn is not None:
+        print("[stats] tables")
+        for table in ("pages", "template_kv", "npc_core"):
+            n = conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            print(f"  {table}: {n} rows")
+
+    if not runs:
+        print(f"[stats] no metrics recorded yet in {metrics_path}")
+        return
+
+    for cmd, s in runs.items():
+        print(f"[stats] last {cmd}: started {s['started_at']}, {s['elapsed_secs']}s")
+        for stage, secs in s.get("stages_secs", {}).items():
+            print(f"  stage {stage}: {secs}s")
+        for k, v in s.get("counters", {}).items():
+            print(f"  {k}: {v}")
+        http = s.get("http", {})
+        if http.get("requests"):
+            print(f"  http: {http['requests']} requests, {http['requests_per_sec']} req/s, "
+                  f"{http['bytes_fetched']} bytes, avg {http['avg_latency_ms']}ms")
+            print("  latency: " + ", ".join(f"{k} {v}" for k, v in http["latency_histogram"].items()))
+        parse = s.get("parse", {})
+        if parse.get("pages"):
+            print(f"  parse: {parse['pages']} pages in {parse['secs']}s, avg {parse['avg_ms']}ms/page")
+            for p in parse.get("slowest_pages", [])[:5]:
+                print(f"    slow: {p['ms']}ms {p['title']}")
+        db = s.get("db", {})
+        if db.get("writes"):
+            print(f"  db: {db['writes']} writes, {db['write_secs']}s")
+        mem = s.get("memory", {})
+        if mem.get("peak_rss_bytes"):
+            print(f"  peak rss: {mem['peak_rss_bytes'] / 1e6:.1f} MB")
+        if mem.get("peak_traced_bytes"):
+            print(f"  peak traced: {mem['peak_traced_bytes'] / 1e6:.2f} MB")
@@ -1,10 +1,16 @@
-import sqlite3
 import pandas as pd
 import streamlit as st
 import numpy as np
 import plotly.express as px
+import plotly.graph_objects as go
+
+from db import connect_readonly
+from textstore import decode_wikitext
 
 DB_PATH = "data/p99.sqlite"
+MAX_SCATTER_POINTS = 5000
+MAX_COLOR_ZONES = 15
+MAX_TABLE_ROWS = 1000
 
 st.set_page_config(page_title="P99 NPC Strength Analysis", layout="wide")
 st.title("P99 NPC Strength Analysis")
@@ -16,7 +22,7 @@ if st.sidebar.button("Back to Inventory Explorer"):
 
 @st.cache_data
 def load_core():
-    conn = sqlite3.connect(DB_PATH)
+    conn = connect_readonly(DB_PATH)
     df = pd.read_sql_query("SELECT * FROM npc_core", conn)
     conn.close()
     # Clean up zone names (remove [[ ]])
@@ -25,17 +31,111 @@ def load_core():
 
 @st.cache_data
 def load_kv_for_title(title: str):
-    conn = sqlite3.connect(DB_PATH)
+    conn = connect_readonly(DB_PATH)
     kv = pd.read_sql_query(
         "SELECT template_name, param_name, param_value FROM template_kv WHERE title = ? ORDER BY template_name, param_name",
         conn,
         params=(title,)
     )
-    wt = pd.read_sql_query("SELECT wikitext FROM pages WHERE title = ?", conn, params=(title,))
+    row = conn.execute("SELECT wikitext FROM pages WHERE title = ?", (title,)).fetchone()
+    wikitext = decode_wikitext(conn, row[0]) if row else ""
     conn.close()
-    wikitext = wt["wikitext"].iloc[0] if len(wt) else ""
     return kv, wikitext
 
+# --- RSI Calculation ---
+def add_rsi(df):
+    by_level = df.groupby("level_min")["hp"]
+
+    # Percentile rank (0 to 100)
+    df["rsi"] = by_level.rank(pct=True) * 100
+
+    # Z-score on log(HP) to handle exponential scaling better
+    log_hp = np.log1p(df["hp"])
+    by_level_log = log_hp.groupby(df["level_min"])
+    std = by_level_log.transform("std")
+    df["hp_zscore"] = ((log_hp - by_level_log.transform("mean")) / std).where(std > 0, 0.0)
+
+    # Neutral if alone
+    alone = by_level.transform("size") < 2
+    df.loc[alone, "rsi"] = 50.0
+    df.loc[alone, "hp_zscore"] = 0.0
+    return df
+
+# --- Cached aggregates ---
+# Keyed on the filter values, so reruns that only change the chart type or the
+# inspected NPC reuse the frames and aggregates instead of recomputing them.
+@st.cache_data
+def load_filtered(hp_threshold: int, lvl_lo: int, lvl_hi: int):
+    df = load_core()
+    df = df[df["hp"] >= hp_threshold]
+    df = df[(df["level_min"] >= lvl_lo) & (df["level_min"] <= lvl_hi)].copy()
+    df = add_rsi(df)
+    df["hp_per_level"] = df["hp"] / df["level_min"]
+    return df
+
+@st.cache_data
+def compute_zone_metrics(hp_threshold: int, lvl_lo: int, lvl_hi: int):
+    df = load_filtered(hp_threshold, lvl_lo, lvl_hi)
+    return df.groupby("zone_clean").agg({
+        "hp_zscore": "mean",
+        "title": "count",
+        "level_min": "mean"
+    }).rename(columns={"hp_zscore": "Avg RSI (Z-Score)", "title": "NPC Count", "level_min": "Avg Level"})
+
+@st.cache_data
+def select_zones(hp_threshold: int, lvl_lo: int, lvl_hi: int, zones: tuple):
+    df = load_filtered(hp_threshold, lvl_lo, lvl_hi)
+    if zones:
+        df = df[df["zone_clean"].isin(zones)]
+    # Plotly draws one trace per color, so only the busiest zones get their own
+    top = df["zone_clean"].value_counts().head(MAX_COLOR_ZONES).index
+    return df.assign(zone_group=df["zone_clean"].where(df["zone_clean"].isin(top), "Other"))
+
+@st.cache_data
+def level_aggregates(hp_threshold: int, lvl_lo: int, lvl_hi: int, zones: tuple):
+    df = select_zones(hp_threshold, lvl_lo, lvl_hi, zones)
+    return df.groupby("level_min")["hp"].agg(
+        count="count",
+        p10=lambda s: s.quantile(0.1),
+        median="median",
+        p90=lambda s: s.quantile(0.9),
+    ).reset_index()
+
+@st.cache_data
+def level_zone_counts(hp_threshold: int, lvl_lo: int, lvl_hi: int, zones: tuple):
+    df = select_zones(hp_threshold, lvl_lo, lvl_hi, zones)
+    return df.groupby(["level_min", "zone_group"]).size().reset_index(name="count")
+
+@st.cache_data
+def hp_level_density(hp_threshold: int, lvl_lo: int, lvl_hi: int, zones: tuple, hp_bins: int):
+    # 2D histogram of level x log10(HP), binned here so the browser only gets the grid
+    df = select_zones(hp_threshold, lvl_lo, lvl_hi, zones).dropna(subset=["level_min", "hp"])
+    df = df[df["hp"] > 0]
+    if df.empty:
+        return None
+    log_hp = np.log10(df["hp"].astype(float))
+    lvl_edges = np.arange(df["level_min"].min() - 0.5, df["level_min"].max() + 1.5, 1.0)
+    hp_edges = np.linspace(log_hp.min(), log_hp.max() + 1e-9, hp_bins + 1)
+    counts, _, _ = np.histogram2d(df["level_min"].astype(float), log_hp, bins=[lvl_edges, hp_edges])
+    return {
+        "levels": (lvl_edges[:-1] + 0.5).astype(int),
+        "hp": 10 ** ((hp_edges[:-1] + hp_edges[1:]) / 2),
+        "counts": counts.T,
+    }
+
+@st.cache_data
+def downsample(hp_threshold: int, lvl_lo: int, lvl_hi: int, zones: tuple, max_points: int):
+    # Even sample per level; the lowest- and highest-HP NPC of each level are always kept
+    df = select_zones(hp_threshold, lvl_lo, lvl_hi, zones)
+    if len(df) <= max_points:
+        return df
+    hp_df = df.dropna(subset=["hp"])
+    extremes = pd.Index(hp_df.groupby("level_min")["hp"].idxmin()).union(hp_df.groupby("level_min")["hp"].idxmax())
+    rest = df.drop(extremes)
+    frac = max(0.0, (max_points - len(extremes)) / len(rest))
+    sample = rest.groupby("level_min").sample(frac=frac, random_state=99)
+    return pd.concat([df.loc[extremes], sample])
+
 df_raw = load_core()
 
 # --- Sidebar Filters & Outlier Removal ---
@@ -43,34 +143,14 @@ st.sidebar.header("Global Filters & Outlier Removal")
 
 # Filter out NPCs with very low HP (likely data entry errors or special cases)
 hp_outlier_threshold = st.sidebar.number_input("Min HP Threshold (Filter Outliers)", value=10, min_value=0)
-df = df_raw[df_raw["hp"] >= hp_outlier_threshold].copy()
+df_hp = df_raw[df_raw["hp"] >= hp_outlier_threshold]
 
 # Filter by Level Range
-min_lvl, max_lvl = int(df["level_min"].min() or 1), int(df["level_min"].max() or 60)
+min_lvl, max_lvl = int(df_hp["level_min"].min() or 1), int(df_hp["level_min"].max() or 60)
 level_range = st.sidebar.slider("Level Range", min_lvl, max_lvl, (min_lvl, max_lvl))
-df = df[(df["level_min"] >= level_range[0]) & (df["level_min"] <= level_range[1])]
 
-# --- RSI Calculation ---
-def calculate_rsi(group):
-    if len(group) < 2:
-        group["rsi"] = 50.0 # Neutral if alone
-        group["hp_zscore"] = 0.0
-        return group
-    
-    # Percentile rank (0 to 100)
-    group["rsi"] = group["hp"].rank(pct=True) * 100
-    
-    # Z-score on log(HP) to handle exponential scaling better
-    log_hp = np.log1p(group["hp"])
-    std = log_hp.std()
-    if std > 0:
-        group["hp_zscore"] = (log_hp - log_hp.mean()) / std
-    else:
-        group["hp_zscore"] = 0.0
-        
-    return group
-
-df = df.groupby("level_min", group_keys=False).apply(calculate_rsi)
+filter_key = (int(hp_outlier_threshold), int(level_range[0]), int(level_range[1]))
+df = load_filtered(*filter_key)
 
 # --- About RSI ---
 with st.expander("ℹ️ About Relative Strength Index (RSI)"):
@@ -89,11 +169,7 @@ with st.expander("ℹ️ About Relative Strength Index (RSI)"):
 
 # --- Zone Analysis ---
 st.sidebar.header("Zone Analysis")
-zone_metrics = df.groupby("zone_clean").agg({
-    "hp_zscore": "mean",
-    "title": "count",
-    "level_min": "mean"
-}).rename(columns={"hp_zscore": "Avg RSI (Z-Score)", "title": "NPC Count", "level_min": "Avg Level"})
+zone_metrics = compute_zone_metrics(*filter_key)
 
 st.sidebar.dataframe(zone_metrics.sort_values("Avg RSI (Z-Score)", ascending=False).head(10))
 
@@ -102,44 +178,72 @@ st.header("HP Distribution by Level")
 
 all_zones = sorted(df["zone_clean"].dropna().unique())
 selected_zones = st.multiselect("Filter by Zones", all_zones)
+zone_key = filter_key + (tuple(selected_zones),)
 
-plot_df = df.copy()
-if selected_zones:
-    plot_df = plot_df[plot_df["zone_clean"].isin(selected_zones)]
+plot_df = select_zones(*zone_key)
 
-fig_type = st.radio("Visualization Type", ["Scatter (HP vs Level)", "Stacked Bar (Count by Level)"])
+fig_type = st.radio("Visualization Type", ["Scatter (HP vs Level)", "Density (HP vs Level)", "Stacked Bar (Count by Level)"])
 
 if fig_type == "Scatter (HP vs Level)":
+    max_points = st.slider("Max points plotted", 1000, 50000, MAX_SCATTER_POINTS, step=1000)
+    points = downsample(*zone_key, max_points)
+    if len(points) < len(plot_df):
+        st.caption(f"Showing {len(points)} of {len(plot_df)} NPCs (sampled per level; lowest/highest HP per level always shown).")
     fig = px.scatter(
-        plot_df, 
-        x="level_min", 
-        y="hp", 
-        color="zone_clean",
-        hover_data=["title", "rsi"],
+        points,
+        x="level_min",
+        y="hp",
+        color="zone_group",
+        hover_data=["title", "zone_clean", "rsi"],
         log_y=True,
+        render_mode="webgl",
         title="NPC HP by Level (Log Scale)",
-        labels={"level_min": "Level", "hp": "HP", "zone_clean": "Zone", "rsi": "RSI"}
+        labels={"level_min": "Level", "hp": "HP", "zone_group": "Zone", "zone_clean": "Zone", "rsi": "RSI"}
     )
+    agg = level_aggregates(*zone_key)
+    fig.add_trace(go.Scattergl(x=agg["level_min"], y=agg["median"], mode="lines", name="Median HP",
+                               line=dict(color="black")))
     st.plotly_chart(fig, use_container_width=True)
+elif fig_type == "Density (HP vs Level)":
+    hp_bins = st.slider("HP bins", 10, 100, 40)
+    dens = hp_level_density(*zone_key, hp_bins)
+    if dens is None:
+        st.info("No NPCs with HP match the current filters.")
+    else:
+        fig = go.Figure(go.Heatmap(
+            x=dens["levels"],
+            y=dens["hp"],
+            z=dens["counts"],
+            colorscale="Viridis",
+            colorbar=dict(title="NPCs"),
+            hovertemplate="Level %{x}<br>HP ~%{y:.0f}<br>%{z:.0f} NPCs<extra></extra>",
+        ))
+        agg = level_aggregates(*zone_key)
+        for col, name in (("p10", "10th pct"), ("median", "Median"), ("p90", "90th pct")):
+            fig.add_trace(go.Scatter(x=agg["level_min"], y=agg[col], mode="lines", name=name))
+        fig.update_layout(title="NPC Density by Level and HP (Log Scale)", xaxis_title="Level", yaxis_title="HP")
+        fig.update_yaxes(type="log")
+        st.plotly_chart(fig, use_container_width=True)
 else:
     fig = px.bar(
-        plot_df.groupby(["level_min", "zone_clean"]).size().reset_index(name="count"),
+        level_zone_counts(*zone_key),
         x="level_min",
         y="count",
-        color="zone_clean",
+        color="zone_group",
         title="NPC Count by Level and Zone",
-        labels={"level_min": "Level", "count": "NPC Count", "zone_clean": "Zone"}
+        labels={"level_min": "Level", "count": "NPC Count", "zone_group": "Zone"}
     )
     st.plotly_chart(fig, use_container_width=True)
 
 # --- Data Table ---
 st.subheader(f"NPC Data (Filtered: {len(plot_df)})")
 
-plot_df["hp_per_level"] = plot_df["hp"] / plot_df["level_min"]
-
 cols_to_show = ["title", "level_min", "hp", "rsi", "hp_per_level", "zone_clean", "class"]
+table_df = plot_df[cols_to_show].sort_values("rsi", ascending=False).head(MAX_TABLE_ROWS)
+if len(table_df) < len(plot_df):
+    st.caption(f"Showing the top {len(table_df)} of {len(plot_df)} NPCs by RSI; narrow the filters to see the rest.")
 st.dataframe(
-    plot_df[cols_to_show].sort_values("rsi", ascending=False),
+    table_df,
     use_container_width=True,
     column_config={
         "rsi": st.column_config.NumberColumn("RSI (Percentile)", format="%.1f"),
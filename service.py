@@ -0,0 +1,311 @@
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from config import SERVICE_CACHE_SIZE, SERVICE_MAX_LIMIT, SERVICE_RELOAD_CHECK_SECS
+from db import connect_readonly
+from levelindex import build_level_index
+from normalize import normalize_int
+
+SORT_KEYS = ("hp", "hp_per_level", "rsi", "level_min", "level_max", "ac", "atk", "title")
+
+class NotFound(Exception):
+    """A valid request for something the dataset doesn't have; answered with 404."""
+
+def clean_zone(zone):
+    if zone is None:
+        return None
+    z = re.sub(r"\[\[(?:[^|\]]*\|)?([^\]]+)\]\]", r"\1", str(zone)).strip()
+    return z or None
+
+def split_classes(cls):
+    if cls is None:
+        return []
+    c = re.sub(r"\[\[(?:[^|\]]*\|)?([^\]]+)\]\]", r"\1", str(cls))
+    c = re.sub(r"\(.*?\)", "", c)
+    parts = re.split(r",|<br\s*/?>|/| or | and ", c, flags=re.IGNORECASE)
+    return [p.strip().lower() for p in parts if len(p.strip()) > 1]
+
+def _as_int(v):
+    return v if isinstance(v, int) or v is None else normalize_int(v)
+
+def _percentile_ranks(values):
+    """
+    Same as pandas rank(pct=True): average rank of ties / count, None stays None.
+    """
+    present = sorted((v, i) for i, v in enumerate(values) if v is not None)
+    out = [None] * len(values)
+    n = len(present)
+    j = 0
+    while j < n:
+        k = j
+        while k + 1 < n and present[k + 1][0] == present[j][0]:
+            k += 1
+        rank = (j + k + 2) / 2
+        for _, i in present[j:k + 1]:
+            out[i] = rank / n * 100
+        j = k + 1
+    return out
+
+class Dataset:
+    """
+    Immutable snapshot of npc_core plus lookup indexes. A reload builds a new
+    Dataset and swaps it in, so readers never see a half-built index.
+    """
+
+    def __init__(self, db_path: str):
+        conn = connect_readonly(db_path)
+        conn.row_factory = sqlite3.Row
+        rows = conn.execute(
+            "SELECT title, level_min, level_max, hp, ac, atk, zone, race, class, npc_id FROM npc_core"
+        ).fetchall()
+        conn.close()
+
+        self.rows = []
+        for r in rows:
+            d = dict(r)
+            for k in ("level_min", "level_max", "hp", "ac", "atk", "npc_id"):
+                d[k] = _as_int(d[k])
+            if d["level_max"] is None:
+                d["level_max"] = d["level_min"]
+            d["zone"] = clean_zone(d["zone"])
+            d["hp_per_level"] = d["hp"] / d["level_min"] if d["hp"] is not None and d["level_min"] else None
+            self.rows.append(d)
+
+        self.by_title = {}
+        self.levels = build_level_index([d["level_min"] for d in self.rows], [d["level_max"] for d in self.rows])
+        self.by_zone = {}
+        self.by_class = {}
+        zone_names = {}
+        for i, d in enumerate(self.rows):
+            self.by_title[d["title"]] = i
+            if d["zone"]:
+                self.by_zone.setdefault(d["zone"].lower(), []).append(i)
+                zone_names.setdefault(d["zone"].lower(), d["zone"])
+            for c in split_classes(d["class"]):
+                self.by_class.setdefault(c, []).append(i)
+
+        # RSI: HP percentile among NPCs of the same level_min (as in the viewer)
+        groups = {}
+        for i, d in enumerate(self.rows):
+            groups.setdefault(d["level_min"], []).append(i)
+        for idxs in groups.values():
+            if len(idxs) < 2:
+                for i in idxs:
+                    self.rows[i]["rsi"] = 50.0
+                continue
+            for i, rsi in zip(idxs, _percentile_ranks([self.rows[i]["hp"] for i in idxs])):
+                self.rows[i]["rsi"] = rsi
+
+        self.zone_counts = sorted(((zone_names[z], len(v)) for z, v in self.by_zone.items()), key=lambda x: -x[1])
+        self.loaded_at = time.time()
+
+    def query(self, level=None, min_level=None, max_level=None, zone=None, cls=None):
+        """
+        Intersects the index postings for each given filter; returns row indexes.
+        level matches NPCs whose level range covers it; min_level/max_level
+        match ranges that overlap the window.
+        """
+        sets = []
+        if level is not None:
+            sets.append(set(self.levels.overlapping(level)))
+        if min_level is not None or max_level is not None:
+            lo = min_level if min_level is not None else 0
+            hi = max_level if max_level is not None else 10**9
+            sets.append(set(self.levels.overlapping(lo, hi)))
+        if zone:
+            sets.append(set(self.by_zone.get(zone.lower(), ())))
+        if cls:
+            sets.append(set(self.by_class.get(cls.lower(), ())))
+
+        if not sets:
+            return range(len(self.rows))
+        sets.sort(key=len)
+        out = sets[0]
+        for s in sets[1:]:
+            out = out & s
+        return out
+
+class QueryService:
+    def __init__(self, db_path: str, cache_size: int = SERVICE_CACHE_SIZE):
+        self.db_path = db_path
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.data = Dataset(db_path)
+        self._signature = self._db_signature()
+        self._checked_at = time.monotonic()
+        print(f"[service] loaded {len(self.data.rows)} NPCs")
+
+    def _db_signature(self):
+        sig = []
+        for p in (self.db_path, self.db_path + "-wal"):
+            try:
+                st = os.stat(p)
+                sig.append((st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                sig.append(None)
+        return tuple(sig)
+
+    def maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked_at < SERVICE_RELOAD_CHECK_SECS:
+            return
+        if not self._reload_lock.acquire(blocking=False):
+            return  # another thread is already checking/reloading
+        try:
+            self._checked_at = now
+            sig = self._db_signature()
+            if sig == self._signature:
+                return
+            try:
+                data = Dataset(self.db_path)
+            except Exception as e:
+                # replaced/locked/half-written DB: keep the old snapshot, retry on the next check
+                print(f"[service] reload failed, serving previous data: {e!r}")
+                return
+            with self._lock:
+                self.data = data
+                self._signature = sig
+                self._cache.clear()
+            print(f"[service] reloaded {len(data.rows)} NPCs")
+        finally:
+            self._reload_lock.release()
+
+    def handle(self, path: str, params: dict) -> bytes:
+        self.maybe_reload()
+        if path == "/health":
+            return json.dumps(self.route(self.data, path, params)).encode("utf-8")
+        key = (path, tuple(sorted(params.items())))
+        with self._lock:
+            body = self._cache.get(key)
+            if body is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return body
+            self.misses += 1
+            data = self.data
+
+        body = json.dumps(self.route(data, path, params)).encode("utf-8")
+
+        with self._lock:
+            if data is self.data:
+                self._cache[key] = body
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return body
+
+    def route(self, data, path, params):
+        if path == "/health":
+            return {
+                "rows": len(data.rows),
+                "loaded_at": data.loaded_at,
+                "cache": {"size": len(self._cache), "hits": self.hits, "misses": self.misses},
+            }
+        if path == "/zones":
+            return [{"zone": z, "count": n} for z, n in data.zone_counts]
+        if path == "/npc":
+            title = params.get("title")
+            if not title:
+                raise ValueError("title is required")
+            i = data.by_title.get(title)
+            if i is None:
+                raise NotFound(f"no NPC titled {title!r}")
+            return data.rows[i]
+        if path in ("/npcs", "/squishiest"):
+            return self.search(data, params, squishiest=(path == "/squishiest"))
+        raise KeyError(path)
+
+    def search(self, data, params, squishiest=False):
+        def int_param(name):
+            v = params.get(name)
+            return int(v) if v not in (None, "") else None
+
+        idxs = data.query(
+            level=int_param("level"),
+            min_level=int_param("min_level"),
+            max_level=int_param("max_level"),
+            zone=params.get("zone"),
+            cls=params.get("class"),
+        )
+        rows = [data.rows[i] for i in idxs]
+
+        sort = params.get("sort", "hp" if squishiest else "title")
+        if sort not in SORT_KEYS:
+            raise ValueError(f"sort must be one of {', '.join(SORT_KEYS)}")
+        desc = params.get("order", "asc") == "desc"
+        if squishiest:
+            rows = [r for r in rows if r["hp"] is not None]
+        present = [r for r in rows if r[sort] is not None]
+        missing = [r for r in rows if r[sort] is None]
+        present.sort(key=lambda r: r[sort], reverse=desc)
+
+        limit = int_param("limit")
+        offset = int_param("offset")
+        if limit is not None and limit < 1:
+            raise ValueError("limit must be at least 1")
+        if offset is not None and offset < 0:
+            raise ValueError("offset must not be negative")
+        limit = min(limit or 50, SERVICE_MAX_LIMIT)
+        offset = offset or 0
+        results = (present + missing)[offset:offset + limit]
+        return {"total": len(rows), "results": results}
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+def make_handler(service: QueryService):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send(self, code, body: bytes):
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            u = urlparse(self.path)
+            params = {k: v[-1] for k, v in parse_qs(u.query).items()}
+            try:
+                self._send(200, service.handle(u.path, params))
+            except NotFound as e:
+                self._send(404, json.dumps({"error": str(e)}).encode("utf-8"))
+            except KeyError:
+                self._send(404, json.dumps({"error": f"unknown endpoint {u.path}"}).encode("utf-8"))
+            except ValueError as e:
+                self._send(400, json.dumps({"error": str(e)}).encode("utf-8"))
+            except Exception as e:
+                print(f"[service] error handling {self.path}: {e!r}")
+                self._send(500, json.dumps({"error": "internal error"}).encode("utf-8"))
+
+    return Handler
+
+def serve(db_path: str, host: str, port: int):
+    """
+    Read-only JSON API over npc_core:
+      /npcs?level=&min_level=&max_level=&zone=&class=&sort=&order=&limit=&offset=
+      /squishiest?level=23&zone=...   (same filters, lowest HP first)
+      /npc?title=...   /zones   /health
+    """
+    service = QueryService(db_path)
+    httpd = Server((host, port), make_handler(service))
+    print(f"[service] listening on http://{host}:{port}")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
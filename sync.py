@@ -0,0 +1,239 @@
+import queue
+import threading
+import time
+from config import MAX_FETCH_ATTEMPTS, SYNC_BATCH_SIZE, SYNC_FLUSH_SECS, SYNC_QUEUE_SIZE
+from db import RC_MARK, get_state, set_state
+from derive import pick_npc_core_from_templates
+from facts import refresh_facts
+from ingest import FETCH_ERRORS, enqueue_failed, iter_category_pages, upsert_page
+from mediawiki import fetch_categories, fetch_wikitext, iter_recent_changes, oldest_recent_change
+from metrics import METRICS
+from parse import KvInterner, delete_parsed, parse_all_templates, write_parsed
+
+_DONE = object()
+
+def _produce(members, out, skip, max_pages, stop):
+    """
+    Network side: fetches pages and hands them to the consumer. Runs in its own
+    thread so the next fetch overlaps with parsing the previous page.
+    """
+    try:
+        n = 0
+        for m in members:
+            if stop.is_set():
+                break
+            title = m["title"]
+            if title in skip:
+                continue
+            try:
+                out.put(("page", title, fetch_wikitext(title)))
+            except FETCH_ERRORS as e:
+                out.put(("failed", title, e))
+            n += 1
+            if max_pages and n >= max_pages:
+                break
+    except BaseException as e:
+        out.put(("error", None, e))
+    finally:
+        out.put(_DONE)
+
+def _flush(conn, batch, kv, parsed_titles):
+    if not batch:
+        return
+    cur = conn.cursor()
+    with METRICS.db_write():
+        for kind, title, payload, parsed in batch:
+            if kind == "failed":
+                print(f"[sync] failed {title}: {payload} (queued for retry)")
+                enqueue_failed(cur, title, payload)
+                continue
+            upsert_page(cur, payload)
+            cur.execute("DELETE FROM fetch_queue WHERE title = ?", (title,))
+            if parsed is not None:
+                write_parsed(cur, title, *parsed, kv, payload["revision_id"])
+                parsed_titles.append(title)
+        conn.commit()
+    batch.clear()
+
+def sync_titles(conn, members, skip=frozenset(), max_pages: int = 0) -> int:
+    """
+    Producer/consumer pipeline: a fetch thread feeds a bounded queue while this
+    thread parses each page and writes raw + parsed rows in batched transactions.
+    npc_facts is refreshed for the parsed titles once the queue is drained.
+    """
+    out = queue.Queue(maxsize=SYNC_QUEUE_SIZE)
+    stop = threading.Event()
+    producer = threading.Thread(target=_produce, args=(members, out, skip, max_pages, stop), daemon=True)
+    producer.start()
+
+    kv = KvInterner(conn)
+    batch = []
+    parsed_titles = []
+    count = 0
+    last_flush = time.monotonic()
+    try:
+        while True:
+            try:
+                item = out.get(timeout=SYNC_FLUSH_SECS)
+            except queue.Empty:
+                item = None
+
+            if item is _DONE:
+                break
+            if item is not None:
+                kind, title, payload = item
+                if kind == "error":
+                    raise payload
+
+                parsed = None
+                if kind == "page":
+                    METRICS.count("pages_fetched")
+                    if payload["wikitext"]:
+                        t = time.perf_counter()
+                        template_rows = list(parse_all_templates(payload["wikitext"]))
+                        core = pick_npc_core_from_templates(template_rows)
+                        METRICS.record_page_parse(title, time.perf_counter() - t)
+                        parsed = (template_rows, core)
+                else:
+                    METRICS.count("fetch_failures")
+                batch.append((kind, title, payload, parsed))
+
+                count += 1
+                if count % 250 == 0:
+                    print(f"[sync] {count} pages… latest={title} (queue {out.qsize()})")
+
+            if len(batch) >= SYNC_BATCH_SIZE or (batch and time.monotonic() - last_flush >= SYNC_FLUSH_SECS):
+                _flush(conn, batch, kv, parsed_titles)
+                last_flush = time.monotonic()
+    finally:
+        stop.set()
+        _flush(conn, batch, kv, parsed_titles)
+
+    producer.join()
+    refresh_facts(conn, parsed_titles)
+    return count
+
+def sync_category(conn, category: str, max_pages: int = 0, refetch: bool = False,
+                  recursive: bool = False, max_depth=None):
+    """
+    Fetch + parse in one streaming pass. Pages we already have are skipped
+    unless refetch=True; titles left in fetch_queue get one more pass at the end.
+    The category (tree) is listed up front, which is cheap next to the page
+    fetches, so membership rows are written from this thread.
+    """
+    skip = frozenset()
+    if not refetch:
+        skip = frozenset(r[0] for r in conn.execute(
+            "SELECT title FROM pages WHERE wikitext IS NOT NULL AND wikitext != ''"
+        ).fetchall())
+        print(f"[sync] skipping {len(skip)} pages we already have")
+
+    members = list(iter_category_pages(conn, category, recursive, max_depth))
+    print(f"[sync] {category}: {len(members)} pages")
+    count = sync_titles(conn, members, skip, max_pages)
+
+    queued = [{"title": r[0]} for r in conn.execute(
+        "SELECT title FROM fetch_queue WHERE attempts < ? ORDER BY queued_at", (MAX_FETCH_ATTEMPTS,)
+    ).fetchall()]
+    if queued:
+        print(f"[sync] retrying {len(queued)} queued titles")
+        sync_titles(conn, queued)
+        left = conn.execute("SELECT COUNT(*) FROM fetch_queue").fetchone()[0]
+        print(f"[sync] {left} titles still queued")
+
+    print(f"[sync] done: {count} pages")
+
+def _move_target(rc):
+    move = rc.get("move") or {}
+    params = rc.get("logparams") or {}
+    return move.get("new_title") or params.get("target_title")
+
+def delta_sync(conn, category: str):
+    """
+    Refreshes only what changed since the stored high-water mark, using
+    list=recentchanges (edits, creations, deletes, moves) instead of listing the
+    whole category. Changed titles we don't know yet are kept only if they sit in
+    `category` or a subcategory we've crawled.
+    """
+    since = get_state(conn, RC_MARK)
+    if not since:
+        oldest = conn.execute("SELECT MIN(fetched_at) FROM pages").fetchone()[0]
+        if not oldest:
+            print("[delta] no pages yet; run a full sync first")
+            return
+        since = oldest.replace(" ", "T") + "Z"
+        print(f"[delta] no high-water mark yet; starting from oldest fetch {since}")
+
+    # marks from the oldest fetch or a dump import can predate what the wiki
+    # still keeps in recentchanges; a delta from there would silently miss edits
+    retained = oldest_recent_change()
+    if retained and since < retained:
+        print(f"[delta] mark {since} is older than the oldest retained recent change "
+              f"({retained}); run a full `sync` instead")
+        return
+
+    known = set(r[0] for r in conn.execute("SELECT title FROM pages").fetchall())
+    known.update(r[0] for r in conn.execute("SELECT title FROM category_members WHERE ns = 0").fetchall())
+
+    changed = {}  # title -> already known to be an NPC page
+    deleted = set()
+    latest = since
+    n = 0
+    for rc in iter_recent_changes(since):
+        n += 1
+        latest = max(latest, rc.get("timestamp") or latest)
+        title = rc.get("title")
+        if rc.get("type") == "log":
+            logtype, action = rc.get("logtype"), rc.get("logaction")
+            if logtype == "delete" and action == "delete":
+                deleted.add(title)
+                changed.pop(title, None)
+            elif logtype == "delete" and action == "restore":
+                deleted.discard(title)
+                changed[title] = title in known
+            elif logtype == "move":
+                target = _move_target(rc)
+                deleted.add(title)
+                was_npc = changed.pop(title, title in known)
+                if target:
+                    deleted.discard(target)
+                    changed[target] = was_npc or target in known
+            continue
+        deleted.discard(title)
+        changed[title] = changed.get(title) or title in known
+
+    print(f"[delta] {n} changes since {since}: {len(changed)} titles changed, {len(deleted)} removed")
+
+    cur = conn.cursor()
+    unknown = [t for t, is_npc in changed.items() if not is_npc]
+    if unknown:
+        tracked = [category] + [r[0] for r in conn.execute(
+            "SELECT DISTINCT title FROM category_members WHERE ns = 14"
+        ).fetchall()]
+        cats = fetch_categories(unknown, tracked)
+        for title in unknown:
+            for c in cats.get(title, ()):
+                cur.execute("INSERT OR IGNORE INTO category_members (category, title, ns) VALUES (?, ?, 0)", (c, title))
+            if not cats.get(title):
+                del changed[title]
+        conn.commit()
+
+    removed = 0
+    for title in deleted & known:
+        cur.execute("DELETE FROM pages WHERE title = ?", (title,))
+        cur.execute("DELETE FROM category_members WHERE title = ?", (title,))
+        cur.execute("DELETE FROM fetch_queue WHERE title = ?", (title,))
+        delete_parsed(cur, title)
+        removed += 1
+    conn.commit()
+
+    # earlier failures won't show up in recentchanges again; retry them alongside
+    queued = [r[0] for r in conn.execute(
+        "SELECT title FROM fetch_queue WHERE attempts < ? ORDER BY queued_at", (MAX_FETCH_ATTEMPTS,)
+    ).fetchall() if r[0] not in changed]
+    if queued:
+        print(f"[delta] retrying {len(queued)} queued titles")
+    titles = list(changed) + queued
+    count = sync_titles(conn, [{"title": t} for t in titles]) if titles else 0
+    set_state(conn, RC_MARK, latest)
+    print(f"[delta] done: {count} pages refreshed, {removed} removed; high-water mark {latest}")
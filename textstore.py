@@ -0,0 +1,179 @@
+"""
+Transparent compression for pages.wikitext.
+
+Compressed values are BLOBs: b"z" + 4-byte dictionary id + raw deflate stream.
+Plain TEXT values (older rows, or COMPRESS_WIKITEXT=False) pass through
+untouched, so readers only ever need decode_wikitext().
+
+NPC pages share most of their boilerplate, so we train a preset deflate
+dictionary (zlib zdict) from a sample of stored pages. The dictionary id is
+the crc32 of its bytes, which keeps ids stable across databases and lets us
+cache dictionaries process-wide.
+"""
+import random
+import struct
+import time
+import zlib
+from collections import Counter
+
+from config import COMPRESS_WIKITEXT, WIKITEXT_DICT_SIZE, WIKITEXT_DICT_SAMPLE
+
+MAGIC = b"z"
+HEADER = struct.Struct(">I")
+LEVEL = 9
+
+_dicts = {0: b""}
+
+def _load_dict(conn, dict_id: int) -> bytes:
+    d = _dicts.get(dict_id)
+    if d is None:
+        row = conn.execute("SELECT data FROM wikitext_dicts WHERE dict_id = ?", (dict_id,)).fetchone()
+        if row is None:
+            raise ValueError(f"unknown wikitext dictionary {dict_id}")
+        d = _dicts[dict_id] = bytes(row[0])
+    return d
+
+def current_dict_id(conn) -> int:
+    """
+    The most recently trained dictionary, 0 if there is none. Cached on
+    db.connect() connections; train_dictionary refreshes it.
+    """
+    dict_id = getattr(conn, "wikitext_dict_id", None)
+    if dict_id is None:
+        row = conn.execute("SELECT dict_id FROM wikitext_dicts ORDER BY seq DESC LIMIT 1").fetchone()
+        dict_id = row[0] if row else 0
+        if hasattr(conn, "wikitext_dict_id"):
+            conn.wikitext_dict_id = dict_id
+    return dict_id
+
+def encode_wikitext(conn, text, dict_id=None):
+    if not text or not COMPRESS_WIKITEXT:
+        return text
+    if dict_id is None:
+        dict_id = current_dict_id(conn)
+    zdict = _load_dict(conn, dict_id)
+    c = zlib.compressobj(LEVEL, zlib.DEFLATED, -15, zdict=zdict) if zdict else zlib.compressobj(LEVEL, zlib.DEFLATED, -15)
+    return MAGIC + HEADER.pack(dict_id) + c.compress(text.encode("utf-8")) + c.flush()
+
+def decode_wikitext(conn, value):
+    """
+    Returns the wikitext as str, whatever form it is stored in.
+    """
+    if value is None or isinstance(value, str):
+        return value
+    value = bytes(value)
+    if value[:1] != MAGIC:
+        return value.decode("utf-8")
+    (dict_id,) = HEADER.unpack_from(value, 1)
+    zdict = _load_dict(conn, dict_id)
+    d = zlib.decompressobj(-15, zdict=zdict) if zdict else zlib.decompressobj(-15)
+    return (d.decompress(value[1 + HEADER.size:]) + d.flush()).decode("utf-8")
+
+def build_dictionary(samples, size: int = WIKITEXT_DICT_SIZE) -> bytes:
+    """
+    Picks the lines (and `|param =` prefixes) that recur across many sample
+    pages, weighted by how many bytes they would save. deflate matches closer
+    strings more cheaply, so the most valuable ones go at the end.
+    """
+    doc_freq = Counter()
+    for text in samples:
+        pieces = set()
+        for line in text.splitlines():
+            line = line.strip()
+            if len(line) < 4:
+                continue
+            pieces.add(line)
+            if "=" in line:
+                pieces.add(line[:line.index("=") + 1])
+        doc_freq.update(pieces)
+
+    ranked = sorted(
+        (p for p, n in doc_freq.items() if n >= 2),
+        key=lambda p: doc_freq[p] * len(p),
+        reverse=True,
+    )
+
+    chosen = []
+    total = 0
+    for p in ranked:
+        b = p.encode("utf-8") + b"\n"
+        if total + len(b) > size:
+            continue
+        chosen.append(b)
+        total += len(b)
+
+    return b"".join(reversed(chosen))
+
+def train_dictionary(conn, sample: int = WIKITEXT_DICT_SAMPLE) -> int:
+    titles = [r[0] for r in conn.execute("SELECT title FROM pages WHERE wikitext IS NOT NULL").fetchall()]
+    if not titles:
+        return 0
+    picked = random.sample(titles, min(sample, len(titles)))
+
+    samples = []
+    for title in picked:
+        (value,) = conn.execute("SELECT wikitext FROM pages WHERE title = ?", (title,)).fetchone()
+        samples.append(decode_wikitext(conn, value) or "")
+
+    zdict = build_dictionary(samples)
+    if not zdict:
+        return 0
+    dict_id = zlib.crc32(zdict)
+    conn.execute("""
+        INSERT INTO wikitext_dicts (dict_id, data, seq)
+        VALUES (?, ?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM wikitext_dicts))
+        ON CONFLICT(dict_id) DO UPDATE SET created_at=datetime('now'), seq=excluded.seq
+    """, (dict_id, zdict))
+    conn.commit()
+    _dicts[dict_id] = zdict
+    if hasattr(conn, "wikitext_dict_id"):
+        conn.wikitext_dict_id = dict_id
+    print(f"[compress] trained dictionary {dict_id}: {len(zdict)} bytes from {len(samples)} pages")
+    return dict_id
+
+def db_size(conn) -> int:
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    return page_size * page_count
+
+def compress_pages(conn, retrain: bool = False, vacuum: bool = True, batch: int = 500):
+    """
+    Migrates pages.wikitext to the current dictionary: trains one if needed,
+    re-encodes plain or stale rows, then VACUUMs to give the space back.
+    """
+    if not COMPRESS_WIKITEXT:
+        print("[compress] COMPRESS_WIKITEXT is off; nothing to do")
+        return
+
+    t = time.perf_counter()
+    size_before = db_size(conn)
+    col_before = conn.execute("SELECT COALESCE(SUM(length(wikitext)), 0) FROM pages").fetchone()[0]
+
+    dict_id = current_dict_id(conn)
+    if retrain or not dict_id:
+        dict_id = train_dictionary(conn) or dict_id
+
+    prefix = MAGIC + HEADER.pack(dict_id)
+    titles = [r[0] for r in conn.execute("SELECT title FROM pages WHERE wikitext IS NOT NULL AND wikitext != ''").fetchall()]
+    cur = conn.cursor()
+    changed = 0
+    for i in range(0, len(titles), batch):
+        chunk = titles[i:i + batch]
+        marks = ",".join("?" * len(chunk))
+        updates = []
+        for title, value in cur.execute(f"SELECT title, wikitext FROM pages WHERE title IN ({marks})", chunk).fetchall():
+            if isinstance(value, bytes) and value[:len(prefix)] == prefix:
+                continue
+            updates.append((encode_wikitext(conn, decode_wikitext(conn, value), dict_id), title))
+        cur.executemany("UPDATE pages SET wikitext = ? WHERE title = ?", updates)
+        conn.commit()
+        changed += len(updates)
+
+    col_after = conn.execute("SELECT COALESCE(SUM(length(wikitext)), 0) FROM pages").fetchone()[0]
+    if vacuum:
+        conn.execute("VACUUM")
+    size_after = db_size(conn)
+
+    print(f"[compress] re-encoded {changed}/{len(titles)} pages in {time.perf_counter() - t:.1f}s")
+    print(f"[compress] wikitext column: {col_before / 1e6:.1f} MB -> {col_after / 1e6:.1f} MB")
+    print(f"[compress] database file: {size_before / 1e6:.1f} MB -> {size_after / 1e6:.1f} MB")
@@ -1,16 +1,18 @@
-import sqlite3
 import pandas as pd
 import streamlit as st
 import numpy as np
 
 from config import DB_PATH
+from db import connect_readonly
+from levelindex import build_level_index
+from textstore import decode_wikitext
 
 st.set_page_config(page_title="P99 NPC Inventory", layout="wide")
 st.title("P99 NPC Explorer")
 
 @st.cache_data
 def load_core():
-    conn = sqlite3.connect(DB_PATH)
+    conn = connect_readonly(DB_PATH)
     df = pd.read_sql_query("SELECT * FROM npc_core", conn)
     conn.close()
 
@@ -100,23 +102,33 @@ def load_core():
 
 @st.cache_data
 def load_kv_for_title(title: str):
-    conn = sqlite3.connect(DB_PATH)
+    conn = connect_readonly(DB_PATH)
     kv = pd.read_sql_query(
         "SELECT template_name, param_name, param_value FROM template_kv WHERE title = ? ORDER BY template_name, param_name",
         conn,
         params=(title,)
     )
-    wt = pd.read_sql_query("SELECT wikitext FROM pages WHERE title = ?", conn, params=(title,))
+    row = conn.execute("SELECT wikitext FROM pages WHERE title = ?", (title,)).fetchone()
+    wikitext = decode_wikitext(conn, row[0]) if row else ""
     conn.close()
-    wikitext = wt["wikitext"].iloc[0] if len(wt) else ""
     return kv, wikitext
 
+@st.cache_resource
+def load_level_index():
+    core = load_core()
+    return build_level_index(core["level_min"], core["level_max"])
+
 df = load_core()
 
 # Sidebar filters
 st.sidebar.header("Filters")
 
 q = st.sidebar.text_input("Title contains", "")
+level_mode = st.sidebar.radio(
+    "Level filter",
+    ["Min level in range", "Level range overlaps"],
+    help="'Overlaps' matches ranged mobs (e.g. 12-14) whose range touches the window, i.e. mobs that con for those levels.",
+)
 min_level = st.sidebar.number_input("Min level >=", value=0, min_value=0, step=1)
 max_level = st.sidebar.number_input("Max level <=", value=60, min_value=0, step=1)
 hp_min = st.sidebar.number_input("HP >=", value=0, min_value=0, step=50)
@@ -138,15 +150,19 @@ if "Unknown" in all_classes:
 
 class_filter = st.sidebar.selectbox("Class", ["All"] + all_classes)
 
-filtered = df.copy()
+if level_mode == "Level range overlaps":
+    filtered = df.iloc[load_level_index().overlapping(min_level, max_level)].copy()
+else:
+    filtered = df.copy()
 
 if q:
     filtered = filtered[filtered["title"].str.contains(q, case=False, na=False)]
 
-filtered = filtered[
-    (filtered["level_min"].fillna(-1) >= min_level) &
-    (filtered["level_min"].fillna(10**9) <= max_level)
-]
+if level_mode == "Min level in range":
+    filtered = filtered[
+        (filtered["level_min"].fillna(-1) >= min_level) &
+        (filtered["level_min"].fillna(10**9) <= max_level)
+    ]
 
 filtered = filtered[
     (filtered["hp"].fillna(-1) >= hp_min) &